@@ -0,0 +1,153 @@
+"""Databases the dashboard pages can read from
+
+The pages read from the Postgres database of db.py, or, with
+DB_BACKEND=duckdb, from a local DuckDB file written by export_duckdb.py
+(DUCKDB_PATH, hospitals.duckdb by default), so they can run and be
+benchmarked offline. Both backends run the queries of queries.py
+unchanged, apart from their %s placeholders.
+"""
+import os
+import threading
+import time
+import db
+
+DEFAULT_DUCKDB_PATH = "hospitals.duckdb"
+
+_backend = None
+# Held while the backend is created, see db.pool
+_backend_lock = threading.Lock()
+
+
+def text_size(rows):
+    """Size of result values written as text, as Postgres sends them."""
+    return sum(len(str(value)) for row in rows for value in row
+               if value is not None)
+
+
+class PostgresBackend:
+    """Queries on connections borrowed from the pool in db.py."""
+    name = "postgres"
+
+    def fetch(self, query, params=None):
+        """Run a query.
+        Parameters
+        ----------
+        query : str
+        params : list, optional
+
+        Returns
+        -------
+        (list of tuple, list of str)
+            Result rows and column names
+        """
+        return db.fetch(query, params)
+
+    def profile(self, query, params=None, explain=False):
+        """Run a query and measure it.
+        Parameters
+        ----------
+        query : str
+        params : list, optional
+        explain : bool
+            Also run it under EXPLAIN (ANALYZE, BUFFERS)
+
+        Returns
+        -------
+        (list of tuple, list of str, dict)
+            Result rows, column names, and the wall time in ms, bytes
+            fetched and plan (None unless explain)
+        """
+        with db.pool().connection() as conn:
+            start = time.perf_counter()
+            cur = conn.execute(query, params)
+            rows = cur.fetchall()
+            ms = (time.perf_counter() - start) * 1000
+            result = cur.pgresult
+            # Size of the values as received, before conversion to Python
+            size = sum(len(result.get_value(row, col) or b"")
+                       for row in range(result.ntuples)
+                       for col in range(result.nfields))
+            columns = [desc[0] for desc in cur.description]
+            plan = None
+            if explain:
+                plan = "\n".join(line for line, in conn.execute(
+                    "EXPLAIN (ANALYZE, BUFFERS) " + query.rstrip("; \n"),
+                    params).fetchall())
+        return rows, columns, {"ms": ms, "bytes": size, "plan": plan}
+
+
+class DuckDBBackend:
+    """Queries on a local DuckDB file, opened read-only.
+    Parameters
+    ----------
+    path : str
+        File written by export_duckdb.py
+    """
+    name = "duckdb"
+
+    def __init__(self, path):
+        import duckdb
+
+        self.path = path
+        self.conn = duckdb.connect(path, read_only=True)
+
+    def cursor(self):
+        """A cursor of its own for the calling thread; DuckDB connections
+        can't be shared between threads."""
+        return self.conn.cursor()
+
+    @staticmethod
+    def translate(query):
+        """DuckDB takes ? placeholders where psycopg takes %s."""
+        return query.replace("%s", "?")
+
+    def fetch(self, query, params=None):
+        """Run a query, see PostgresBackend.fetch."""
+        cur = self.cursor()
+        try:
+            cur.execute(self.translate(query), params or [])
+            return cur.fetchall(), [desc[0] for desc in cur.description]
+        finally:
+            cur.close()
+
+    def profile(self, query, params=None, explain=False):
+        """Run a query and measure it, see PostgresBackend.profile. Bytes
+        are the size of the values as text, to compare with Postgres."""
+        cur = self.cursor()
+        try:
+            start = time.perf_counter()
+            cur.execute(self.translate(query), params or [])
+            rows = cur.fetchall()
+            ms = (time.perf_counter() - start) * 1000
+            columns = [desc[0] for desc in cur.description]
+            plan = None
+            if explain:
+                cur.execute("EXPLAIN ANALYZE " + self.translate(query),
+                            params or [])
+                plan = "\n".join(value for _, value in cur.fetchall())
+        finally:
+            cur.close()
+        return rows, columns, {"ms": ms, "bytes": text_size(rows),
+                               "plan": plan}
+
+
+def current():
+    """Backend chosen by the DB_BACKEND environment variable, "postgres"
+    by default or "duckdb", created once per process.
+    Returns
+    -------
+    PostgresBackend or DuckDBBackend
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.environ.get("DB_BACKEND", "postgres")
+            if name == "duckdb":
+                _backend = DuckDBBackend(
+                    os.environ.get("DUCKDB_PATH", DEFAULT_DUCKDB_PATH))
+            elif name == "postgres":
+                _backend = PostgresBackend()
+            else:
+                raise ValueError(f"Unknown DB_BACKEND {name!r}, use "
+                                 "postgres or duckdb")
+    return _backend
@@ -0,0 +1,371 @@
+"""Backfill many HHS or hospital quality files in one run"""
+import argparse
+import glob
+import os
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+import db
+import hhs
+import hospital_grid
+import loader_cache
+import manifest
+import quality
+import validate
+from writers import copy_rows, insert_rows
+
+
+def find_files(pattern):
+    """List the CSV files to load, oldest first by name.
+    Parameters
+    ----------
+    pattern : str
+        A directory or a glob pattern
+
+    Returns
+    -------
+    list of str
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.csv")
+    return sorted(glob.glob(pattern))
+
+
+def quality_date(file_path):
+    """Date of a quality file, taken from a YYYY-MM-DD in its name.
+    Parameters
+    ----------
+    file_path : str
+
+    Returns
+    -------
+    str
+        Date formatted as YYYY-MM-DD
+    """
+    match = re.search(r'(\d{4}-\d{2}-\d{2})', os.path.basename(file_path))
+    if not match:
+        raise ValueError(f"No YYYY-MM-DD date in file name {file_path}")
+    return match.group(1)
+
+
+def quality_date_value(file_path):
+    """Date of a quality file as a datetime.date."""
+    return datetime.strptime(quality_date(file_path), "%Y-%m-%d").date()
+
+
+def cached(cache_dir, dataset, checksum, tables, date=None):
+    """Cleaned frames of a file from the cache, None on a cache miss."""
+    if not cache_dir:
+        return None
+    entry = loader_cache.entry_path(cache_dir, dataset, checksum, date)
+    meta = loader_cache.read_meta(entry)
+    if meta is None:
+        return None
+    parts = list(loader_cache.read_parts(entry, tables))
+    frames = [pd.concat([part[i] for part in parts], ignore_index=True)
+              for i in range(len(tables))]
+    return meta["rows_read"], frames
+
+
+def save(cache_dir, dataset, checksum, file_path, rows_read, frames,
+         date=None):
+    """Write the cleaned frames of a file to the cache."""
+    cache = loader_cache.EntryWriter(cache_dir, dataset, checksum,
+                                     file_path, date)
+    cache.add(rows_read, frames)
+    cache.close()
+
+
+def prepare_hhs(file_path, checksum, cache_dir=None):
+    """Read and clean one HHS file in a worker process."""
+    hit = cached(cache_dir, "hhs", checksum, ["weekly", "demo", "rejects"])
+    if hit:
+        rows_read, (df1, df2, rejects) = hit
+    else:
+        df = hhs.read(file_path)
+        rows_read = len(df)
+        df1, df2, rejects = hhs.clean(df)
+        if cache_dir:
+            save(cache_dir, "hhs", checksum, file_path, rows_read,
+                 {"weekly": df1, "demo": df2, "rejects": rejects})
+    # Consistent lock order when several writers upsert the same hospitals
+    return (file_path, checksum, rows_read, df1, df2.sort_values("id"),
+            rejects)
+
+
+def prepare_quality(file_path, checksum, cache_dir=None):
+    """Read and clean one quality file in a worker process."""
+    date = quality_date_value(file_path)
+    hit = cached(cache_dir, "quality", checksum,
+                 ["demo", "quality", "rejects"], date)
+    if hit:
+        rows_read, (df_demo, df_quality, rejects) = hit
+    else:
+        df = quality.read(file_path)
+        rows_read = len(df)
+        df_demo, df_quality, rejects = quality.clean(
+            df, quality_date(file_path))
+        if cache_dir:
+            save(cache_dir, "quality", checksum, file_path, rows_read,
+                 {"demo": df_demo, "quality": df_quality,
+                  "rejects": rejects}, date)
+    return (file_path, checksum, rows_read,
+            df_demo.sort_values("hospital_id"), df_quality, rejects)
+
+
+def write_hhs(conn, file_path, checksum, rows_read, df1, df2, rejects,
+              bulk, force):
+    """Write one cleaned HHS file, demo rows before weekly rows, and
+    tell whether demo rows were written. RuntimeError when a table's
+    write failed and was rolled back."""
+    write_rows = copy_rows if bulk else insert_rows
+    weeks = df1['collection_week'].dt.date
+    validate.record_rejects(conn, "hhs", file_path, rejects)
+    if not force:
+        df1, df2 = hhs.drop_loaded(conn, df1, df2)
+    demo_count, weekly_count = hhs.write(conn, df1, df2, write_rows)
+    hhs.refresh_rollup(conn, weeks)
+    if demo_count or weekly_count:
+        manifest.bump_data_version(conn)
+    print(f"{file_path}: {demo_count} rows into demo, "
+          f"{weekly_count} rows into weekly, {len(rejects)} rejected")
+    if demo_count is not None and weekly_count is not None:
+        manifest.record_load(conn, "hhs", file_path, checksum, rows_read,
+                             demo_count, weekly_count, weeks)
+    else:
+        raise RuntimeError("some rows were not written")
+    return bool(demo_count)
+
+
+def write_quality(conn, file_path, checksum, rows_read, df, df_quality,
+                  rejects, bulk, force):
+    """Write one cleaned quality file, demo rows before quality rows,
+    and tell whether demo rows were written. RuntimeError when a table's
+    write failed and was rolled back."""
+    hospitals = df_quality['hospital_id']
+    validate.record_rejects(conn, "quality", file_path, rejects)
+    if not force:
+        df, df_quality = quality.drop_loaded(conn, df, df_quality)
+    write = quality.copy_write if bulk else quality.write
+    demo_count, quality_count = write(conn, df, df_quality)
+    quality.refresh_asof(conn, hospitals)
+    if demo_count or quality_count:
+        manifest.bump_data_version(conn)
+    print(f"{file_path}: {demo_count} rows into demo, "
+          f"{quality_count} rows into quality, {len(rejects)} rejected")
+    if demo_count is not None and quality_count is not None:
+        manifest.record_load(conn, "quality", file_path, checksum,
+                             rows_read, demo_count, quality_count,
+                             [quality_date_value(file_path)])
+    else:
+        raise RuntimeError("some rows were not written")
+    return bool(demo_count)
+
+
+def is_loaded(conn, dataset, file_path, checksum):
+    """Whether the load manifest already has this file."""
+    week = quality_date_value(file_path) if dataset == "quality" else None
+    return manifest.find_load(conn, dataset, checksum, week) is not None
+
+
+def put(jobs, item, dead):
+    """Queue an item for the writers, failing once one of them stopped
+    instead of waiting forever for room in the queue.
+    Parameters
+    ----------
+    jobs : queue.Queue
+    item : tuple or None
+    dead : threading.Event
+        Set by a writer that stopped on an error
+    """
+    while True:
+        if dead.is_set():
+            raise RuntimeError("A writer stopped after a database error")
+        try:
+            jobs.put(item, timeout=1)
+            return
+        except queue.Full:
+            pass
+
+
+def queue_result(jobs, file_path, future, dead, failed):
+    """Hand a cleaned file to the writers, adding files whose cleaning
+    failed to the failed list instead."""
+    try:
+        result = future.result()
+    except Exception as err:
+        print(err, " while cleaning ", file_path)
+        failed.append(file_path)
+        return
+    put(jobs, result, dead)
+
+
+def writer(conn, jobs, dead, changed, failed, write, bulk, force):
+    """Take cleaned files off the queue and write them to the database
+    until a None sentinel arrives.
+    Parameters
+    ----------
+    conn : psycopg connection
+        Connection of this writer, closed when it stops
+    jobs : queue.Queue
+        Cleaned files produced by the worker processes
+    dead : threading.Event
+        Set when the writer stops before the sentinel, e.g. when its
+        connection is lost and the rollback fails
+    changed : threading.Event
+        Set once a file wrote demo rows, so the map grid is stale
+    failed : list of str
+        Files whose write failed, appended to
+    write : callable
+        write_hhs or write_quality
+    bulk : bool
+        Write through COPY and staging tables
+    force : bool
+        Resend rows that are already in the database
+    """
+    finished = False
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                finished = True
+                break
+            try:
+                if write(conn, *job, bulk, force):
+                    changed.set()
+            except Exception as err:
+                print(err, " while writing ", job[0])
+                failed.append(job[0])
+                # Part of the file may be written
+                changed.set()
+                conn.rollback()
+    finally:
+        if not finished:
+            dead.set()
+        conn.close()
+
+
+def stop_writers(jobs, threads):
+    """Send each writer its sentinel and wait for them to finish the
+    files left in the queue. Writers that stopped take no sentinel."""
+    for _ in threads:
+        while any(thread.is_alive() for thread in threads):
+            try:
+                jobs.put(None, timeout=1)
+                break
+            except queue.Full:
+                pass
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load a directory or glob of HHS or quality files")
+    parser.add_argument("dataset", choices=["hhs", "quality"])
+    parser.add_argument("pattern",
+                        help="directory of CSV files or a glob pattern; "
+                             "quality file names must contain the date "
+                             "of the data as YYYY-MM-DD")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of processes reading and cleaning "
+                             "files")
+    parser.add_argument("--writers", type=int, default=1,
+                        help="number of database connections writing "
+                             "cleaned files")
+    parser.add_argument("--queue-size", type=int, default=4,
+                        help="cleaned files allowed to wait for a writer")
+    parser.add_argument("--copy", action="store_true",
+                        help="bulk load through COPY and staging tables")
+    parser.add_argument("--force", action="store_true",
+                        help="load files even if the load manifest says "
+                             "they were already loaded")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse cleaned rows from a columnar cache in "
+                             "DIR, writing them there on a cache miss")
+    args = parser.parse_args()
+    if args.workers < 1 or args.writers < 1:
+        parser.error("--workers and --writers must be at least 1")
+
+    files = find_files(args.pattern)
+    if not files:
+        raise ValueError(f"No files match {args.pattern}")
+
+    if args.dataset == "hhs":
+        prepare, write = prepare_hhs, write_hhs
+    else:
+        prepare, write = prepare_quality, write_quality
+
+    # Every connection is opened before any writer starts, so a database
+    # that can't be reached stops the run before anything is queued.
+    # The first one looks up the load manifest
+    conns = []
+    try:
+        for _ in range(args.writers + 1):
+            conns.append(db.connect())
+    except Exception:
+        for conn in conns:
+            conn.close()
+        raise
+    conn = conns[0]
+
+    # Bounded queue: workers stall once writers fall behind, so memory
+    # holds at most queue_size + workers cleaned files
+    jobs = queue.Queue(maxsize=args.queue_size)
+    dead = threading.Event()
+    changed = threading.Event()
+    # Files that could not be cleaned or written, reported at the end
+    failed = []
+    threads = [threading.Thread(target=writer,
+                                args=(writer_conn, jobs, dead, changed,
+                                      failed, write, args.copy, args.force))
+               for writer_conn in conns[1:]]
+    for thread in threads:
+        thread.start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            # Files are queued in name order as their cleaning finishes
+            pending = deque()
+            for file_path in files:
+                checksum = manifest.file_checksum(file_path)
+                try:
+                    loaded = is_loaded(conn, args.dataset, file_path,
+                                       checksum)
+                except ValueError as err:
+                    print(err, ", skipped")
+                    continue
+                if loaded and not args.force:
+                    print(f"{file_path} was already loaded, skipping")
+                    continue
+                pending.append((file_path, pool.submit(
+                    prepare, file_path, checksum, args.cache)))
+                if len(pending) >= args.workers:
+                    queue_result(jobs, *pending.popleft(), dead, failed)
+            while pending:
+                queue_result(jobs, *pending.popleft(), dead, failed)
+    finally:
+        stop_writers(jobs, threads)
+        conn.close()
+
+    if changed.is_set():
+        # The map grid is recomputed once all files are written, rather
+        # than after each of them, and the dashboard then drops the maps
+        # it cached from the old grid
+        conn = db.connect()
+        hospital_grid.refresh(conn)
+        manifest.bump_data_version(conn)
+        conn.close()
+    if failed:
+        print(f"{len(failed)} files failed, load them again once fixed:")
+        for file_path in sorted(failed):
+            print(f"  {file_path}")
+    if dead.is_set():
+        raise RuntimeError("A writer stopped after a database error, "
+                           "files it had not written are missing")
+    if failed:
+        raise SystemExit(1)
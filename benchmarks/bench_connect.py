@@ -0,0 +1,102 @@
+"""Benchmark the database cost of one dashboard rerun: a new connection
+per rerun, as the pages used to open, against connections borrowed from
+the pool in db.py
+
+Each rerun sends the queries of the chosen page for the latest week.
+Connection settings are read like the dashboard does (credentials.py and
+the DB_* environment variables), so run it against the real server to
+see the handshake cost the pool saves.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import psycopg
+
+# Set up parent directory for module imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import db  # noqa: E402
+import hospital_grid  # noqa: E402
+import queries  # noqa: E402
+
+
+def page_queries(page, week):
+    """Queries one rerun of a page sends, with their parameters, for the
+    latest week and the map at its default zoom."""
+    if page == "weekly":
+        return [(queries.WEEK_OPTIONS, None),
+                (queries.WEEKLY_METRICS, None),
+                (queries.BED_FRACTION_BY_QUALITY, [week] * 3),
+                (queries.COVID_BY_QUALITY, [week] * 3),
+                (queries.COVID_BEDS_BY_STATE, [week])]
+    return [(queries.GEOCODED_STATES, None),
+            queries.zip_search(),
+            queries.hospital_cells(
+                hospital_grid.resolution(hospital_grid.MIN_ZOOM))]
+
+
+def rerun_connect(shapes):
+    """One rerun on a fresh connection, closed at the end."""
+    with psycopg.connect(**db.settings()) as conn:
+        for query, params in shapes:
+            conn.execute(query, params).fetchall()
+
+
+def rerun_pool(shapes):
+    """One rerun borrowing a pooled connection for each query."""
+    for query, params in shapes:
+        db.fetch(query, params)
+
+
+def time_reruns(rerun, shapes, count):
+    """Milliseconds taken by each of count reruns."""
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        rerun(shapes)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summary(times):
+    """Mean, median and 95th percentile of rerun times."""
+    ordered = sorted(times)
+    return {"mean": statistics.mean(ordered),
+            "median": statistics.median(ordered),
+            "p95": ordered[min(len(ordered) - 1,
+                               int(round(0.95 * (len(ordered) - 1))))]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page", choices=["weekly", "emergency"],
+                        default="weekly")
+    parser.add_argument("--reruns", type=int, default=20)
+    args = parser.parse_args()
+
+    with db.connect() as conn:
+        week, = conn.execute(
+            "SELECT max(collection_week) FROM week_catalog;").fetchone()
+    shapes = page_queries(args.page, week)
+
+    before = time_reruns(rerun_connect, shapes, args.reruns)
+    # The first pooled rerun also opens the pool, as the first page view
+    # after the server starts does
+    start = time.perf_counter()
+    rerun_pool(shapes)
+    cold = (time.perf_counter() - start) * 1000
+    after = time_reruns(rerun_pool, shapes, args.reruns)
+
+    print(f"{args.page} page, {len(shapes)} queries per rerun, "
+          f"{args.reruns} reruns, ms per rerun")
+    print(f"{'':<16}{'mean':>10}{'median':>10}{'p95':>10}")
+    for name, times in [("new connection", before), ("pool", after)]:
+        stats = summary(times)
+        print(f"{name:<16}{stats['mean']:>10.1f}{stats['median']:>10.1f}"
+              f"{stats['p95']:>10.1f}")
+    print(f"first pooled rerun, opening the pool: {cold:.1f} ms")
+    speedup = summary(before)["median"] / summary(after)["median"]
+    print(f"median speed-up: {speedup:.1f}x")
+    db.pool().close()
@@ -0,0 +1,91 @@
+"""Benchmark one weekly report render: the panel queries sent one after
+the other, as the page used to, against all at once from a thread pool,
+as it does now
+
+Queries go to the backend the dashboard uses (DB_BACKEND, see
+backends.py), so the same run works against Postgres or a DuckDB file.
+With the queries in parallel a render should take about as long as its
+slowest query rather than the sum of all of them.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_connect import summary
+
+# Set up parent directory for module imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import backends  # noqa: E402
+import queries  # noqa: E402
+
+
+def panel_queries(week):
+    """Queries of the weekly report panels, which only depend on the
+    selected week, with their parameters."""
+    return [(queries.WEEKLY_METRICS, None),
+            (queries.BED_FRACTION_BY_QUALITY, [week] * 3),
+            (queries.COVID_BY_QUALITY, [week] * 3),
+            (queries.COVID_BEDS_BY_STATE, [week])]
+
+
+def timed_fetch(backend, query, params):
+    """Milliseconds one query takes."""
+    start = time.perf_counter()
+    backend.fetch(query, params)
+    return (time.perf_counter() - start) * 1000
+
+
+def render_serial(backend, shapes, executor):
+    """One render sending the queries one after the other."""
+    return [timed_fetch(backend, query, params) for query, params in shapes]
+
+
+def render_parallel(backend, shapes, executor):
+    """One render sending all queries at once."""
+    futures = [executor.submit(timed_fetch, backend, query, params)
+               for query, params in shapes]
+    return [future.result() for future in futures]
+
+
+def time_renders(render, backend, shapes, executor, count):
+    """Milliseconds taken by each of count renders, and by the slowest
+    query of each."""
+    times, slowest = [], []
+    for _ in range(count):
+        start = time.perf_counter()
+        query_times = render(backend, shapes, executor)
+        times.append((time.perf_counter() - start) * 1000)
+        slowest.append(max(query_times))
+    return times, slowest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--renders", type=int, default=20)
+    args = parser.parse_args()
+
+    backend = backends.current()
+    rows, _ = backend.fetch("SELECT max(collection_week) FROM week_catalog;")
+    shapes = panel_queries(rows[0][0])
+
+    with ThreadPoolExecutor(max_workers=len(shapes)) as executor:
+        # Opens the pool and warms the caches for both runs
+        render_parallel(backend, shapes, executor)
+        serial, _ = time_renders(render_serial, backend, shapes, executor,
+                                 args.renders)
+        parallel, slowest = time_renders(render_parallel, backend, shapes,
+                                         executor, args.renders)
+
+    print(f"{backend.name}, {len(shapes)} panel queries per render, "
+          f"{args.renders} renders, ms per render")
+    print(f"{'':<16}{'mean':>10}{'median':>10}{'p95':>10}")
+    for name, times in [("one by one", serial), ("in parallel", parallel),
+                        ("slowest query", slowest)]:
+        stats = summary(times)
+        print(f"{name:<16}{stats['mean']:>10.1f}{stats['median']:>10.1f}"
+              f"{stats['p95']:>10.1f}")
+    speedup = summary(serial)["median"] / summary(parallel)["median"]
+    print(f"median speed-up: {speedup:.1f}x")
@@ -0,0 +1,76 @@
+"""Benchmark geocode parsing: row-by-row apply against the vectorized
+extract_lat_long in hhs.py"""
+import argparse
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Set up parent directory for module imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import hhs  # noqa: E402
+
+
+def extract_lat_long_rowwise(geo_address):
+    """Previous per-row implementation, kept as the baseline."""
+    if geo_address == "NA":
+        return pd.Series([None, None])
+    elif pd.notna(geo_address):
+        match = re.match(r'POINT \(([-+]?\d+\.\d+)\s+([-+]?\d+\.\d+)\)',
+                         geo_address)
+        if match:
+            longitude, latitude = map(float, match.groups())
+            return pd.Series([latitude, longitude])
+    return pd.Series([None, None])
+
+
+def synthetic_column(rows, seed=0):
+    """Geocoded addresses with a mix of points, "NA", NaN and malformed
+    strings.
+    Parameters
+    ----------
+    rows : int
+    seed : int
+
+    Returns
+    -------
+    pd.Series
+    """
+    rng = np.random.default_rng(seed)
+    longitude = rng.uniform(-170, -65, rows).round(6)
+    latitude = rng.uniform(18, 71, rows).round(6)
+    geo = pd.Series([f"POINT ({x} {y})" for x, y in zip(longitude, latitude)],
+                    dtype=object)
+    kind = rng.random(rows)
+    geo[kind < 0.03] = "NA"
+    geo[(kind >= 0.03) & (kind < 0.06)] = np.nan
+    geo[(kind >= 0.06) & (kind < 0.08)] = "POINT (bad)"
+    return geo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    geo = synthetic_column(args.rows)
+
+    start = time.perf_counter()
+    rowwise = geo.apply(extract_lat_long_rowwise)
+    rowwise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = hhs.extract_lat_long(geo)
+    vectorized_time = time.perf_counter() - start
+
+    # Both must give the same coordinates and the same missing values
+    rowwise.columns = ["latitude", "longitude"]
+    pd.testing.assert_frame_equal(rowwise.astype(float), vectorized)
+
+    print(f"rows:       {args.rows}")
+    print(f"row-wise:   {rowwise_time:.3f} s")
+    print(f"vectorized: {vectorized_time:.3f} s")
+    print(f"speedup:    {rowwise_time / vectorized_time:.1f}x")
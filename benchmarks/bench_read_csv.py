@@ -0,0 +1,87 @@
+"""Benchmark reading a loader input file: plain pd.read_csv against the
+typed, column-pruned schema of hhs.py or quality.py
+
+Each read runs in a fresh process so that peak RSS is measured for that
+read alone. Run it on a full national file, for example the HHS
+"COVID-19 Reported Patient Impact and Hospital Capacity by Facility"
+extract or the CMS "Hospital General Information" file.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+# Set up parent directory for module imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+def timed_read(dataset, typed, file_path):
+    """Read the file once and measure it.
+    Parameters
+    ----------
+    dataset : str
+        "hhs" or "quality"
+    typed : bool
+        Use the loader's schema instead of plain pd.read_csv
+    file_path : str
+
+    Returns
+    -------
+    dict
+        Parse time in seconds, peak RSS in MB and the frame's size
+    """
+    import pandas as pd
+    import hhs
+    import quality
+
+    module = hhs if dataset == "hhs" else quality
+    # Peak RSS so far covers the interpreter and imports only
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if typed:
+        df = module.read(file_path)
+    else:
+        df = pd.read_csv(file_path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"parse_s": elapsed,
+            "peak_rss_mb": peak / 1024,
+            "read_rss_mb": (peak - before) / 1024,
+            "rows": len(df),
+            "columns": df.shape[1],
+            "frame_mb": df.memory_usage(deep=True).sum() / 2**20}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dataset", choices=["hhs", "quality"])
+    parser.add_argument("file_path")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="reads per mode, the fastest is reported")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'mode':<8}{'parse s':>10}{'peak RSS MB':>14}"
+          f"{'read RSS MB':>14}{'frame MB':>11}{'columns':>9}")
+    results = {}
+    for mode, typed in [("plain", False), ("typed", True)]:
+        runs = []
+        for _ in range(args.repeat):
+            with ctx.Pool(1) as pool:
+                runs.append(pool.apply(timed_read,
+                                       (args.dataset, typed, args.file_path)))
+        best = min(runs, key=lambda run: run["parse_s"])
+        best["peak_rss_mb"] = min(run["peak_rss_mb"] for run in runs)
+        best["read_rss_mb"] = min(run["read_rss_mb"] for run in runs)
+        results[mode] = best
+        print(f"{mode:<8}{best['parse_s']:>10.3f}{best['peak_rss_mb']:>14.1f}"
+              f"{best['read_rss_mb']:>14.1f}{best['frame_mb']:>11.1f}"
+              f"{best['columns']:>9}")
+
+    plain, typed = results["plain"], results["typed"]
+    print(f"parse time: {plain['parse_s'] / typed['parse_s']:.1f}x faster, "
+          f"read RSS: {plain['read_rss_mb'] - typed['read_rss_mb']:.1f} MB "
+          f"less")
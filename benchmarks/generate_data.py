@@ -0,0 +1,289 @@
+"""Generate synthetic HHS weekly and CMS quality CSVs at a chosen scale
+
+One HHS file is written per collection week (hhs_YYYY-MM-DD.csv), with
+the columns the loader reads plus filler columns standing in for the
+rest of the national extract, and one quality file dated at the first
+week (quality-YYYY-MM-DD.csv). A share of the cells is left blank and a
+share of the rows breaks the rules the loaders enforce: malformed
+hospital ids, suppressed -999999 counts, occupied beds above capacity,
+coordinates out of range and unknown emergency service flags.
+"""
+import argparse
+import os
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+
+STATES = ["AL", "AZ", "CA", "CO", "FL", "GA", "IL", "MA", "MI", "NC", "NJ",
+          "NY", "OH", "PA", "TN", "TX", "VA", "WA", "WI"]
+HOSPITAL_TYPES = ["Acute Care Hospitals", "Critical Access Hospitals",
+                  "Childrens", "Psychiatric"]
+OWNERSHIPS = ["Voluntary non-profit - Private", "Proprietary",
+              "Government - State", "Government - Local",
+              "Government - Hospital District or Authority"]
+SUBTYPES = ["Short Term", "Critical Access Hospitals", "Childrens Hospitals",
+            "Long Term"]
+
+
+def hospitals(count, rng):
+    """Attributes that stay the same for a hospital across files.
+    Parameters
+    ----------
+    count : int
+        Number of hospitals
+    rng : np.random.Generator
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    ids = np.arange(10001, 10001 + count)
+    return pd.DataFrame({
+        "hospital_pk": [f"{i:06d}" for i in ids],
+        "state": rng.choice(STATES, count),
+        "hospital_name": [f"Hospital {i}" for i in ids],
+        "address": [f"{i % 9000 + 100} Main St" for i in ids],
+        "city": [f"City {i % 700}" for i in ids],
+        "zip": [f"{z:05d}" for z in rng.integers(1000, 99950, count)],
+        "fips_code": [f"{f:05d}" for f in rng.integers(1001, 56045, count)],
+        "longitude": rng.uniform(-124.5, -67.0, count).round(6),
+        "latitude": rng.uniform(25.0, 49.0, count).round(6),
+        "hospital_subtype": rng.choice(SUBTYPES, count),
+        "type_of_hospital": rng.choice(HOSPITAL_TYPES, count),
+        "type_of_ownership": rng.choice(OWNERSHIPS, count),
+        "emergency": rng.choice(["Yes", "No"], count, p=[0.85, 0.15]),
+        "size": rng.lognormal(4.5, 0.9, count),
+    })
+
+
+def blank(df, columns, rate, rng):
+    """Blank out a share of the cells of some columns, in place."""
+    for column in columns:
+        df.loc[rng.random(len(df)) < rate, column] = ""
+
+
+def violations(rows, rate, kinds, rng):
+    """Pick which rows break which rule.
+    Parameters
+    ----------
+    rows : int
+    rate : float
+        Share of rows breaking a rule
+    kinds : int
+        Number of different rules, spread evenly over the broken rows
+    rng : np.random.Generator
+
+    Returns
+    -------
+    np.ndarray
+        Rule number per row, -1 for rows breaking nothing
+    """
+    kind = rng.integers(0, kinds, rows)
+    return np.where(rng.random(rows) < rate, kind, -1)
+
+
+def hhs_week(hosp, week, null_rate, violation_rate, extra_columns, rng):
+    """Rows of one weekly HHS file.
+    Parameters
+    ----------
+    hosp : pd.DataFrame
+        Hospitals, from hospitals()
+    week : datetime.date
+        Collection week
+    null_rate : float
+        Share of blank cells
+    violation_rate : float
+        Share of rows breaking a rule
+    extra_columns : int
+        Filler numeric columns the loader doesn't read
+    rng : np.random.Generator
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns as named in the HHS extract, values as text
+    """
+    n = len(hosp)
+    size = hosp["size"].to_numpy() * rng.uniform(0.9, 1.1, n)
+    adult_beds = size.round(1)
+    adult_occupied = (adult_beds * rng.uniform(0.4, 0.95, n)).round(1)
+    pediatric_beds = (size * rng.uniform(0, 0.15, n)).round(1)
+    pediatric_occupied = (pediatric_beds * rng.uniform(0, 0.9, n)).round(1)
+    icu_beds = (size * rng.uniform(0.05, 0.2, n)).round(1)
+    icu_occupied = (icu_beds * rng.uniform(0.3, 0.95, n)).round(1)
+    beds_covid = ((adult_occupied + pediatric_occupied)
+                  * rng.uniform(0, 0.3, n)).round(1)
+    icu_covid = (icu_occupied * rng.uniform(0, 0.5, n)).round(1)
+
+    longitude = hosp["longitude"].to_numpy().copy()
+    latitude = hosp["latitude"].to_numpy().copy()
+    hospital_pk = hosp["hospital_pk"].to_numpy().copy()
+
+    # 0: malformed id, 1: suppressed count, 2: occupied above capacity,
+    # 3: latitude too large for DECIMAL(8, 6)
+    kind = violations(n, violation_rate, 4, rng)
+    hospital_pk[kind == 0] = [f"{pk[1:]}F" for pk in hospital_pk[kind == 0]]
+    icu_beds[kind == 1] = -999999.0
+    adult_occupied[kind == 2] = (adult_beds[kind == 2] * 1.2).round(1)
+    latitude[kind == 3] = 100 + rng.uniform(0, 50, (kind == 3).sum())
+
+    df = pd.DataFrame({
+        "hospital_pk": hospital_pk,
+        "collection_week": week.strftime("%Y-%m-%d"),
+        "state": hosp["state"],
+        "ccn": hospital_pk,
+        "hospital_name": hosp["hospital_name"],
+        "address": hosp["address"],
+        "city": hosp["city"],
+        "zip": hosp["zip"],
+        "hospital_subtype": hosp["hospital_subtype"],
+        "fips_code": hosp["fips_code"],
+        "is_metro_micro": rng.choice(["true", "false"], n),
+        "all_adult_hospital_beds_7_day_avg": adult_beds,
+        "all_adult_hospital_inpatient_bed_occupied_7_day_avg":
+            adult_occupied,
+        "all_pediatric_inpatient_beds_7_day_avg": pediatric_beds,
+        "all_pediatric_inpatient_bed_occupied_7_day_avg": pediatric_occupied,
+        "total_icu_beds_7_day_avg": icu_beds,
+        "icu_beds_used_7_day_avg": icu_occupied,
+        "inpatient_beds_used_covid_7_day_avg": beds_covid,
+        "staffed_icu_adult_patients_confirmed_covid_7_day_avg": icu_covid,
+    })
+    for i in range(extra_columns):
+        df[f"extra_metric_{i}_7_day_sum"] = rng.integers(0, 500, n)
+    df["geocoded_hospital_address"] = ("POINT (" + np.char.mod("%.6f",
+                                                                longitude)
+                                       + " " + np.char.mod("%.6f", latitude)
+                                       + ")")
+    df = df.astype(str)
+    blank(df, ["hospital_name", "address", "zip", "fips_code",
+               "geocoded_hospital_address",
+               "all_adult_hospital_beds_7_day_avg",
+               "all_adult_hospital_inpatient_bed_occupied_7_day_avg",
+               "all_pediatric_inpatient_beds_7_day_avg",
+               "all_pediatric_inpatient_bed_occupied_7_day_avg",
+               "total_icu_beds_7_day_avg", "icu_beds_used_7_day_avg",
+               "inpatient_beds_used_covid_7_day_avg",
+               "staffed_icu_adult_patients_confirmed_covid_7_day_avg"],
+          null_rate, rng)
+    return df
+
+
+def quality_file(hosp, null_rate, violation_rate, rng):
+    """Rows of one CMS Hospital General Information file.
+    Parameters
+    ----------
+    hosp : pd.DataFrame
+        Hospitals, from hospitals()
+    null_rate : float
+        Share of blank cells, and of ratings "Not Available"
+    violation_rate : float
+        Share of rows breaking a rule
+    rng : np.random.Generator
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns as named in the CMS file, values as text
+    """
+    n = len(hosp)
+    facility_id = hosp["hospital_pk"].to_numpy().copy()
+    emergency = hosp["emergency"].to_numpy().copy()
+    rating = rng.integers(1, 6, n).astype(str).astype(object)
+    rating[rng.random(n) < null_rate] = "Not Available"
+
+    # 0: malformed id, 1: emergency service flag that isn't a boolean
+    kind = violations(n, violation_rate, 2, rng)
+    facility_id[kind == 0] = [f"{pk[1:]}Q" for pk in facility_id[kind == 0]]
+    emergency[kind == 1] = "Unknown"
+
+    df = pd.DataFrame({
+        "Facility ID": facility_id,
+        "Facility Name": hosp["hospital_name"].str.upper(),
+        "Address": hosp["address"].str.upper(),
+        "City/Town": hosp["city"].str.upper(),
+        "State": hosp["state"],
+        "ZIP Code": hosp["zip"],
+        "County/Parish": "COUNTY",
+        "Telephone Number": "(555) 555-0100",
+        "Hospital Type": hosp["type_of_hospital"],
+        "Hospital Ownership": hosp["type_of_ownership"],
+        "Emergency Services": emergency,
+        "Meets criteria for birthing friendly designation": "",
+        "Hospital overall rating": rating,
+        "Hospital overall rating footnote": "",
+    })
+    blank(df, ["Hospital Type", "Hospital Ownership"], null_rate, rng)
+    return df
+
+
+def generate(out_dir, hospital_count, weeks, start, null_rate,
+             violation_rate, extra_columns, seed):
+    """Write the synthetic files.
+    Parameters
+    ----------
+    out_dir : str
+    hospital_count : int
+    weeks : int
+        Number of weekly HHS files
+    start : datetime.date
+        First collection week, also the date of the quality file
+    null_rate : float
+    violation_rate : float
+    extra_columns : int
+        Filler columns in the HHS files
+    seed : int
+
+    Returns
+    -------
+    dict of str to list of str
+        Paths of the HHS and the quality files, in load order
+    """
+    rng = np.random.default_rng(seed)
+    hosp = hospitals(hospital_count, rng)
+    os.makedirs(out_dir, exist_ok=True)
+    files = {"hhs": [], "quality": []}
+    for i in range(weeks):
+        week = start + timedelta(weeks=i)
+        path = os.path.join(out_dir, f"hhs_{week:%Y-%m-%d}.csv")
+        hhs_week(hosp, week, null_rate, violation_rate, extra_columns,
+                 rng).to_csv(path, index=False)
+        files["hhs"].append(path)
+    path = os.path.join(out_dir, f"quality-{start:%Y-%m-%d}.csv")
+    quality_file(hosp, null_rate, violation_rate, rng).to_csv(path,
+                                                              index=False)
+    files["quality"].append(path)
+    return files
+
+
+def add_arguments(parser):
+    """Add the data generation options to an argument parser."""
+    parser.add_argument("--hospitals", type=int, default=5000,
+                        help="hospitals per file")
+    parser.add_argument("--weeks", type=int, default=4,
+                        help="weekly HHS files to write")
+    parser.add_argument("--start", type=date.fromisoformat,
+                        default=date(2022, 1, 7),
+                        help="first collection week, YYYY-MM-DD")
+    parser.add_argument("--null-rate", type=float, default=0.05,
+                        help="share of blank cells")
+    parser.add_argument("--violation-rate", type=float, default=0.01,
+                        help="share of rows breaking a loader rule")
+    parser.add_argument("--extra-columns", type=int, default=90,
+                        help="filler columns in the HHS files, the "
+                             "national extract has about 100 in all")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out_dir")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    files = generate(args.out_dir, args.hospitals, args.weeks, args.start,
+                     args.null_rate, args.violation_rate,
+                     args.extra_columns, args.seed)
+    for path in files["hhs"] + files["quality"]:
+        print(path, f"{os.path.getsize(path) / 2**20:.1f} MB")
@@ -0,0 +1,302 @@
+"""Ingestion benchmark: load synthetic HHS and quality files into a
+throwaway Postgres and measure each loader stage
+
+For every file the parse (read), clean and insert stages of hhs.py and
+quality.py are timed, then the refresh of the tables derived from what
+was written, with rows per second and the peak RSS of the stage. Files
+come from generate_data.py, or from --data. The tables of the target
+database are DROPPED and recreated before each mode, so point --dsn at
+a local scratch database only, for example one started with
+"docker run -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres". Results
+are written as JSON; pass an earlier result as --baseline to compare.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+import pandas as pd
+import psycopg
+
+import generate_data
+
+# Set up parent directory for module imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import hhs  # noqa: E402
+import hospital_grid  # noqa: E402
+import quality  # noqa: E402
+import migrations  # noqa: E402
+import validate  # noqa: E402
+from writers import copy_rows, insert_rows  # noqa: E402
+
+STAGES = ["parse", "clean", "insert", "refresh"]
+
+
+def reset_peak():
+    """Start a new peak RSS measurement. Linux lets a process reset its
+    high-water mark; elsewhere the peak stays cumulative."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset_peak(), in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(func, *args):
+    """Run one stage.
+    Parameters
+    ----------
+    func : callable
+    *args
+        Arguments of func
+
+    Returns
+    -------
+    (object, float, float)
+        Result of func, seconds taken and peak RSS in MB
+    """
+    reset_peak()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    return result, seconds, peak_rss_mb()
+
+
+def stage(rows, seconds, peak):
+    """Result of one stage as stored in the JSON output."""
+    return {"rows": rows,
+            "seconds": round(seconds, 4),
+            "rows_per_s": round(rows / seconds, 1) if seconds else None,
+            "peak_rss_mb": round(peak, 1)}
+
+
+def ingest_hhs(conn, file_path, bulk):
+    """Load one HHS file the way load-hhs.py does, stage by stage.
+    Parameters
+    ----------
+    conn : psycopg connection
+    file_path : str
+    bulk : bool
+        Write through COPY instead of executemany
+
+    Returns
+    -------
+    dict
+        Row counts and stage results
+    """
+    write_rows = copy_rows if bulk else insert_rows
+    df, *parse = measure(hhs.read, file_path)
+    (df1, df2, rejects), *clean = measure(hhs.clean, df)
+
+    def insert():
+        validate.record_rejects(conn, "hhs", file_path, rejects)
+        return hhs.write(conn, df1, df2, write_rows)
+
+    def refresh():
+        hhs.refresh_rollup(conn, df1['collection_week'].dt.date)
+        hospital_grid.refresh(conn)
+
+    (demo_count, weekly_count), *write = measure(insert)
+    _, *refreshed = measure(refresh)
+    written = (demo_count or 0) + (weekly_count or 0)
+    return {"dataset": "hhs",
+            "file": os.path.basename(file_path),
+            "rows_read": len(df),
+            "rows_rejected": len(rejects),
+            "rows_written": written,
+            "failed": demo_count is None or weekly_count is None,
+            "stages": {"parse": stage(len(df), *parse),
+                       "clean": stage(len(df), *clean),
+                       "insert": stage(written, *write),
+                       "refresh": stage(written, *refreshed)}}
+
+
+def ingest_quality(conn, file_path, bulk):
+    """Load one quality file the way load-quality.py does, stage by
+    stage. The date of the data is taken from the file name.
+    Parameters
+    ----------
+    conn : psycopg connection
+    file_path : str
+    bulk : bool
+        Write through the staging table instead of executemany
+
+    Returns
+    -------
+    dict
+        Row counts and stage results
+    """
+    date = re.search(r"\d{4}-\d{2}-\d{2}",
+                     os.path.basename(file_path)).group()
+    write = quality.copy_write if bulk else quality.write
+    df, *parse = measure(quality.read, file_path)
+    (df_demo, df_quality, rejects), *clean = measure(quality.clean, df,
+                                                     date)
+
+    def insert():
+        validate.record_rejects(conn, "quality", file_path, rejects)
+        return write(conn, df_demo, df_quality)
+
+    def refresh():
+        quality.refresh_asof(conn, df_quality['hospital_id'])
+        hospital_grid.refresh(conn)
+
+    (demo_count, quality_count), *write_stage = measure(insert)
+    _, *refreshed = measure(refresh)
+    written = (demo_count or 0) + (quality_count or 0)
+    return {"dataset": "quality",
+            "file": os.path.basename(file_path),
+            "rows_read": len(df),
+            "rows_rejected": len(rejects),
+            "rows_written": written,
+            "failed": demo_count is None or quality_count is None,
+            "stages": {"parse": stage(len(df), *parse),
+                       "clean": stage(len(df), *clean),
+                       "insert": stage(written, *write_stage),
+                       "refresh": stage(written, *refreshed)}}
+
+
+def totals(results):
+    """Stage results summed over files, per dataset.
+    Parameters
+    ----------
+    results : list of dict
+        Results of ingest_hhs and ingest_quality
+
+    Returns
+    -------
+    dict
+    """
+    summary = {}
+    for dataset in ["hhs", "quality"]:
+        files = [r for r in results if r["dataset"] == dataset]
+        if not files:
+            continue
+        summary[dataset] = {
+            name: stage(sum(f["stages"][name]["rows"] for f in files),
+                        sum(f["stages"][name]["seconds"] for f in files),
+                        max(f["stages"][name]["peak_rss_mb"] for f in files))
+            for name in STAGES}
+    return summary
+
+
+def find_data(data_dir):
+    """HHS and quality files of a directory, in load order."""
+    return {"hhs": sorted(glob.glob(os.path.join(data_dir, "hhs*.csv"))),
+            "quality": sorted(glob.glob(os.path.join(data_dir,
+                                                     "quality*.csv")))}
+
+
+def print_summary(runs, baseline=None):
+    """Print rows per second by mode, dataset and stage, and the speed-up
+    against a baseline result file."""
+    old = {}
+    for run in (baseline or {}).get("runs", []):
+        for dataset, stages in run["totals"].items():
+            for name, result in stages.items():
+                old[run["mode"], dataset, name] = result["rows_per_s"]
+    print(f"{'mode':<8}{'dataset':<9}{'stage':<8}{'rows':>10}{'seconds':>10}"
+          f"{'rows/s':>12}{'peak MB':>10}"
+          + (f"{'vs base':>9}" if baseline else ""))
+    for run in runs:
+        for dataset, stages in run["totals"].items():
+            for name, result in stages.items():
+                line = (f"{run['mode']:<8}{dataset:<9}{name:<8}"
+                        f"{result['rows']:>10}{result['seconds']:>10.3f}"
+                        f"{result['rows_per_s'] or 0:>12.0f}"
+                        f"{result['peak_rss_mb']:>10.1f}")
+                before = old.get((run["mode"], dataset, name))
+                if before and result["rows_per_s"]:
+                    line += f"{result['rows_per_s'] / before:>8.2f}x"
+                print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--dsn", required=True,
+                        help="connection string of a scratch database, "
+                             "e.g. \"host=localhost user=postgres "
+                             "password=bench\"; its tables are dropped")
+    parser.add_argument("--data", metavar="DIR",
+                        help="load the hhs*.csv and quality*.csv files of "
+                             "DIR instead of generating them")
+    parser.add_argument("--mode", choices=["insert", "copy", "both"],
+                        default="both",
+                        help="executemany, COPY and staging tables, or "
+                             "both one after the other")
+    parser.add_argument("--output", default="ingest-results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--baseline", metavar="JSON",
+                        help="earlier result file to compare with")
+    generate_data.add_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.data:
+            files = find_data(args.data)
+        else:
+            files = generate_data.generate(
+                tmp_dir, args.hospitals, args.weeks, args.start,
+                args.null_rate, args.violation_rate, args.extra_columns,
+                args.seed)
+
+        runs = []
+        with psycopg.connect(args.dsn) as conn:
+            server_version = conn.info.server_version
+            modes = ["insert", "copy"] if args.mode == "both" else [args.mode]
+            for mode in modes:
+                migrations.reset(conn)
+                migrations.migrate(conn)
+                results = [ingest_hhs(conn, path, mode == "copy")
+                           for path in files["hhs"]]
+                results += [ingest_quality(conn, path, mode == "copy")
+                            for path in files["quality"]]
+                runs.append({"mode": mode,
+                             "files": results,
+                             "totals": totals(results)})
+
+    # Generation options only describe the data when it was generated
+    config = {"mode": args.mode, "data": args.data}
+    if not args.data:
+        config.update(hospitals=args.hospitals, weeks=args.weeks,
+                      start=args.start.isoformat(),
+                      null_rate=args.null_rate,
+                      violation_rate=args.violation_rate,
+                      extra_columns=args.extra_columns, seed=args.seed)
+    report = {"created": datetime.now().isoformat(timespec="seconds"),
+              "config": config,
+              "environment": {"python": platform.python_version(),
+                              "platform": platform.platform(),
+                              "pandas": pd.__version__,
+                              "psycopg": psycopg.__version__,
+                              "postgres": server_version},
+              "runs": runs}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(runs, baseline)
+    print(f"results written to {args.output}")
@@ -0,0 +1,184 @@
+"""Add the dashboard indexes of schema.py to an existing database
+
+Indexes are built with CREATE INDEX CONCURRENTLY, so the loaders and the
+dashboard keep working while they build, except on a partitioned weekly
+table where Postgres doesn't support it. Each dashboard query in
+queries.py is run under EXPLAIN ANALYZE before and after, and the plans
+and timings are written to a report.
+"""
+import argparse
+import json
+import db
+import hospital_grid
+import queries
+import schema
+
+
+def sample_params(conn):
+    """Parameters for the dashboard queries: the latest week, the state
+    and ZIP code with the most geocoded hospitals, and the densest cell
+    of the finest map grid, as a place clicked on the map.
+    Parameters
+    ----------
+    conn : psycopg connection
+
+    Returns
+    -------
+    (datetime.date, str, str, (float, float))
+    """
+    week, = conn.execute(
+        "SELECT max(collection_week) FROM week_catalog;").fetchone()
+    row = conn.execute(
+        "SELECT state, zip FROM demo "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL "
+        "AND state IS NOT NULL AND zip IS NOT NULL "
+        "GROUP BY state, zip ORDER BY count(*) DESC LIMIT 1;").fetchone()
+    state, zip_code = row or (None, None)
+    center = conn.execute(
+        "SELECT latitude_sum / hospitals, longitude_sum / hospitals "
+        "FROM hospital_grid WHERE resolution = %s "
+        "ORDER BY hospitals DESC LIMIT 1;",
+        [max(hospital_grid.CELL_DEGREES)]).fetchone() or (0.0, 0.0)
+    return week, state, zip_code, center
+
+
+def dashboard_queries(week, state, zip_code, center):
+    """Every query shape the dashboard sends.
+    Parameters
+    ----------
+    week : datetime.date
+        Selected week
+    state : str
+        Selected state on the emergency services page
+    zip_code : str
+        Selected ZIP code on the emergency services page
+    center : (float, float)
+        Place clicked on the map
+
+    Returns
+    -------
+    list of (str, str, list)
+        Name, query and parameters
+    """
+    # What a user types to find the selected ZIP code
+    prefix = (zip_code or "")[:3]
+    # Map views zoomed in on a finer grid, and past the grids
+    region = hospital_grid.viewport(*center, 6)
+    city = hospital_grid.viewport(*center, 10)
+    finest = max(hospital_grid.CELL_DEGREES)
+    return [
+        ("week options", queries.WEEK_OPTIONS, []),
+        ("plots 1, 2, 4 weekly metrics", queries.WEEKLY_METRICS, []),
+        ("plot 3 bed fraction by quality", queries.BED_FRACTION_BY_QUALITY,
+         [week] * 3),
+        ("plot 5 covid by quality", queries.COVID_BY_QUALITY, [week] * 3),
+        ("plot 6 covid beds by state", queries.COVID_BEDS_BY_STATE, [week]),
+        ("state options", queries.GEOCODED_STATES, []),
+        ("zip search", *queries.zip_search(None, prefix)),
+        ("zip search in one state", *queries.zip_search(state, prefix)),
+        ("zip search in one state, no prefix", *queries.zip_search(state)),
+        ("map, all hospitals", *queries.hospital_map()),
+        ("map, one state", *queries.hospital_map(state)),
+        ("map, one zip", *queries.hospital_map(None, zip_code)),
+        ("map, emergency in one state",
+         *queries.hospital_map(state, None, True)),
+        ("map, emergency only", *queries.hospital_map(None, None, True)),
+        ("map extent", *queries.map_extent(finest)),
+        ("map extent, one state", *queries.map_extent(finest, state)),
+        ("map cells, country", *queries.hospital_cells(1)),
+        ("map cells, one state", *queries.hospital_cells(1, None, state)),
+        ("map cells, zoomed in", *queries.hospital_cells(
+            2, hospital_grid.cells(region, 2))),
+        ("map, zoomed in", *queries.hospital_map(
+            None, None, False, city, queries.MAP_POINT_LIMIT)),
+    ]
+
+
+def index_names(plan):
+    """Names of the indexes a plan node and its children use."""
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= index_names(child)
+    return names
+
+
+def explain(conn, query, params, runs):
+    """EXPLAIN ANALYZE a query several times and keep the fastest run.
+    Parameters
+    ----------
+    conn : psycopg connection
+    query : str
+    params : list
+    runs : int
+
+    Returns
+    -------
+    dict
+        Execution time in ms, indexes used and the text plan
+    """
+    best = None
+    for _ in range(runs):
+        result, = conn.execute(
+            "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query.rstrip("; \n"),
+            params).fetchone()[0]
+        if best is None or result["Execution Time"] < best["Execution Time"]:
+            best = result
+    text = conn.execute(
+        "EXPLAIN (ANALYZE, BUFFERS) " + query.rstrip("; \n"), params)
+    return {"ms": best["Execution Time"],
+            "indexes": sorted(index_names(best["Plan"])),
+            "plan": "\n".join(row[0] for row in text.fetchall())}
+
+
+def explain_all(conn, shapes, runs):
+    """EXPLAIN ANALYZE every dashboard query, by name."""
+    return {name: explain(conn, query, params, runs)
+            for name, query, params in shapes}
+
+
+def write_report(path, shapes, before, after, built):
+    """Write the before/after comparison and plans as Markdown."""
+    with open(path, "w") as f:
+        f.write("# Dashboard index report\n\n")
+        f.write("Indexes built: " + (", ".join(built) or "none") + "\n\n")
+        f.write("| Query | Before ms | After ms | Speed-up | Indexes used |\n")
+        f.write("|---|---:|---:|---:|---|\n")
+        for name, _, _ in shapes:
+            old, new = before[name], after[name]
+            speedup = old["ms"] / new["ms"] if new["ms"] else float("inf")
+            f.write(f"| {name} | {old['ms']:.2f} | {new['ms']:.2f} | "
+                    f"{speedup:.1f}x | {', '.join(new['indexes'])} |\n")
+        for name, query, params in shapes:
+            f.write(f"\n## {name}\n\n```sql\n{query.strip()}\n```\n\n")
+            f.write(f"Parameters: {json.dumps(params, default=str)}\n\n")
+            f.write(f"Before:\n\n```\n{before[name]['plan']}\n```\n\n")
+            f.write(f"After:\n\n```\n{after[name]['plan']}\n```\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--report", default="index_report.md",
+                        help="Markdown file for the EXPLAIN ANALYZE report")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="EXPLAIN ANALYZE runs per query, the fastest "
+                             "is reported")
+    args = parser.parse_args()
+
+    conn = db.connect(autocommit=True)
+
+    shapes = dashboard_queries(*sample_params(conn))
+    before = explain_all(conn, shapes, args.runs)
+    built = schema.build_indexes(conn, schema.INDEXES)
+    after = explain_all(conn, shapes, args.runs)
+    write_report(args.report, shapes, before, after, built)
+
+    print(f"{'query':<32}{'before ms':>11}{'after ms':>10}  indexes used")
+    for name, _, _ in shapes:
+        print(f"{name:<32}{before[name]['ms']:>11.2f}"
+              f"{after[name]['ms']:>10.2f}  "
+              f"{', '.join(after[name]['indexes'])}")
+    print(f"report written to {args.report}")
+
+    conn.close()
@@ -0,0 +1,101 @@
+"""Database connections for the loaders, scripts and dashboard pages
+
+Connection settings come from credentials.py, and each can be
+overridden with an environment variable: DB_HOST, DB_PORT, DB_NAME,
+DB_USER and DB_PASSWORD. The scripts open one connection with
+connect(). The dashboard borrows connections from a pool created once
+per process, which outlives Streamlit reruns and sessions, so a widget
+change no longer pays a TLS handshake and authentication. The pool
+needs psycopg_pool installed; DB_POOL_MIN and DB_POOL_MAX size it. Its
+default maximum lets the panel queries of a weekly report render run
+at once.
+"""
+import os
+import threading
+import psycopg
+import credentials
+
+DEFAULT_HOST = "pinniped.postgres.database.azure.com"
+
+# TCP keepalives stop idle pooled connections from being dropped by
+# firewalls and load balancers between the app and Azure
+KEEPALIVES = {"keepalives": 1,
+              "keepalives_idle": 60,
+              "keepalives_interval": 10,
+              "keepalives_count": 5}
+
+_pool = None
+# Streamlit runs sessions in threads, so two first renders could each
+# create a pool
+_pool_lock = threading.Lock()
+
+
+def settings():
+    """Connection settings, environment variables first.
+    Returns
+    -------
+    dict
+        Keyword arguments for psycopg.connect
+    """
+    user = getattr(credentials, "DB_USER", None)
+    return {"host": os.environ.get(
+                "DB_HOST", getattr(credentials, "DB_HOST", DEFAULT_HOST)),
+            "port": os.environ.get(
+                "DB_PORT", getattr(credentials, "DB_PORT", 5432)),
+            "dbname": os.environ.get(
+                "DB_NAME", getattr(credentials, "DB_NAME", user)),
+            "user": os.environ.get("DB_USER", user),
+            "password": os.environ.get(
+                "DB_PASSWORD", getattr(credentials, "DB_PASSWORD", None))}
+
+
+def connect(**kwargs):
+    """Open a new connection to the database.
+    Parameters
+    ----------
+    **kwargs
+        Extra arguments for psycopg.connect, e.g. autocommit=True
+
+    Returns
+    -------
+    psycopg connection
+    """
+    return psycopg.connect(**settings(), **kwargs)
+
+
+def pool():
+    """Connection pool shared by everything in this process, created on
+    first use.
+    Returns
+    -------
+    psycopg_pool.ConnectionPool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from psycopg_pool import ConnectionPool
+
+            _pool = ConnectionPool(
+                kwargs={**settings(), **KEEPALIVES},
+                min_size=int(os.environ.get("DB_POOL_MIN", 1)),
+                max_size=int(os.environ.get("DB_POOL_MAX", 8)),
+                name="babylon",
+                open=True)
+    return _pool
+
+
+def fetch(query, params=None):
+    """Run a query on a pooled connection.
+    Parameters
+    ----------
+    query : str
+    params : list, optional
+
+    Returns
+    -------
+    (list of tuple, list of str)
+        Result rows and column names
+    """
+    with pool().connection() as conn:
+        cur = conn.execute(query, params)
+        return cur.fetchall(), [desc[0] for desc in cur.description]
@@ -0,0 +1,127 @@
+"""Export the tables the dashboard reads from Postgres into a local
+DuckDB file
+
+Each table is streamed out with COPY and loaded into a table of the same
+name and column types, sorted so DuckDB can skip row groups on the
+filters the pages use. The file is written next to the target and then
+moved over it, so a dashboard reading the old file is never left with a
+half-written one. Run the pages on the file with DB_BACKEND=duckdb.
+"""
+import argparse
+import os
+import tempfile
+import time
+import duckdb
+import backends
+import db
+
+# Tables read by the pages, with the order their rows are stored in
+TABLES = [("demo", "state, zip"),
+          ("quality", "hospital_id, date"),
+          ("quality_asof", "valid_to, hospital_id"),
+          ("weekly", "collection_week, hospital_id"),
+          ("weekly_rollup", "collection_week"),
+          ("week_catalog", "collection_week"),
+          ("hospital_grid", "resolution, cell_lat, cell_lon"),
+          ("data_version", "version")]
+
+
+def duckdb_type(data_type, precision, scale):
+    """DuckDB type of a Postgres column.
+    Parameters
+    ----------
+    data_type : str
+        information_schema.columns.data_type
+    precision : int or None
+    scale : int or None
+
+    Returns
+    -------
+    str
+    """
+    if data_type == "numeric":
+        # DuckDB decimals hold 38 digits; Postgres allows any number
+        if precision is None:
+            return "DOUBLE"
+        return f"DECIMAL({precision}, {scale})"
+    return {"integer": "INTEGER",
+            "bigint": "BIGINT",
+            "smallint": "SMALLINT",
+            "double precision": "DOUBLE",
+            "real": "FLOAT",
+            "boolean": "BOOLEAN",
+            "date": "DATE",
+            "timestamp without time zone": "TIMESTAMP"}.get(data_type,
+                                                             "VARCHAR")
+
+
+def table_columns(conn, table):
+    """Columns of a Postgres table and their DuckDB types, in order."""
+    return [(name, duckdb_type(data_type, precision, scale))
+            for name, data_type, precision, scale in conn.execute(
+                "SELECT column_name, data_type, numeric_precision, "
+                "numeric_scale FROM information_schema.columns "
+                "WHERE table_name = %s AND table_schema = current_schema() "
+                "ORDER BY ordinal_position;", [table]).fetchall()]
+
+
+def export_table(conn, duck, table, order, tmp_dir):
+    """Copy one table from Postgres into DuckDB.
+    Parameters
+    ----------
+    conn : psycopg connection
+    duck : duckdb connection
+    table : str
+    order : str
+        ORDER BY list of the rows in DuckDB
+    tmp_dir : str
+        Directory for the intermediate CSV file
+
+    Returns
+    -------
+    int
+        Number of rows exported
+    """
+    columns = table_columns(conn, table)
+    csv_path = os.path.join(tmp_dir, f"{table}.csv")
+    with open(csv_path, "wb") as f:
+        with conn.cursor().copy(
+                f"COPY {table} TO STDOUT (FORMAT csv, HEADER);") as copy:
+            for data in copy:
+                f.write(data)
+    conn.commit()
+
+    definition = ", ".join(f"{name} {kind}" for name, kind in columns)
+    types = ", ".join(f"'{name}': '{kind}'" for name, kind in columns)
+    duck.execute(f"CREATE TABLE {table} ({definition});")
+    duck.execute(f"INSERT INTO {table} SELECT * FROM read_csv(?, "
+                 f"header = true, columns = {{{types}}}) "
+                 f"ORDER BY {order};", [csv_path])
+    os.remove(csv_path)
+    count, = duck.execute(f"SELECT count(*) FROM {table};").fetchone()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", nargs="?",
+                        default=backends.DEFAULT_DUCKDB_PATH,
+                        help="DuckDB file to write, replaced if it exists")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    target = os.path.abspath(args.path)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(target)) as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, os.path.basename(target))
+        duck = duckdb.connect(tmp_path)
+        for table, order in TABLES:
+            start = time.perf_counter()
+            count = export_table(conn, duck, table, order, tmp_dir)
+            print(f"{table}: {count} rows in "
+                  f"{time.perf_counter() - start:.1f} s")
+        duck.execute("CHECKPOINT;")
+        duck.close()
+        os.replace(tmp_path, target)
+    print(f"written to {args.path}")
+
+    conn.close()
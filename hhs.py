@@ -0,0 +1,318 @@
+"""Cleaning and writing of the HHS dataset"""
+import pandas as pd
+import schema
+import validate
+from writers import refresh_rows
+
+
+# Columns for weekly table
+cols = ['all_adult_hospital_beds_7_day_avg',
+        'all_adult_hospital_inpatient_bed_occupied_7_day_avg',
+        'all_pediatric_inpatient_beds_7_day_avg',
+        'all_pediatric_inpatient_bed_occupied_7_day_avg',
+        'total_icu_beds_7_day_avg',
+        'icu_beds_used_7_day_avg',
+        'inpatient_beds_used_covid_7_day_avg',
+        'staffed_icu_adult_patients_confirmed_covid_7_day_avg']
+
+# Columns for demo table
+cols_demo = [
+        'hospital_name',
+        'address',
+        'zip',
+        'fips_code',
+        'state',
+        'geocoded_hospital_address'
+]
+
+DEMO_COLUMNS = ["id", "name", "state", "address", "zip", "fips",
+                "latitude", "longitude"]
+WEEKLY_COLUMNS = ["hospital_id", "collection_week", "adult_beds",
+                  "adult_bed_occupied", "pediatric_beds",
+                  "pediatric_bed_occupied", "icu_beds", "icu_bed_occupied",
+                  "beds_covid", "icu_covid"]
+
+# Update the demographics information when we see the same hospital id
+DEMO_CONFLICT = ("ON CONFLICT (id) DO UPDATE SET "
+                 "name = EXCLUDED.name,"
+                 "state = EXCLUDED.state,"
+                 "address = EXCLUDED.address,"
+                 "zip = EXCLUDED.zip,"
+                 "fips = EXCLUDED.fips,"
+                 "latitude = EXCLUDED.latitude,"
+                 "longitude = EXCLUDED.longitude")
+WEEKLY_CONFLICT = "ON CONFLICT (hospital_id, collection_week) DO NOTHING"
+
+# HHS column names to table column names
+WEEKLY_NAMES = dict(zip(['hospital_pk', 'collection_week'] + cols,
+                        WEEKLY_COLUMNS))
+DEMO_NAMES = {'hospital_pk': 'id',
+              'hospital_name': 'name',
+              'fips_code': 'fips'}
+
+# Per-week sums of the weekly table, for the weeks in the parameter
+ROLLUP_REFRESH = """
+INSERT INTO weekly_rollup
+SELECT collection_week,
+    count(*),
+    sum(adult_beds),
+    sum(adult_bed_occupied),
+    sum(pediatric_beds),
+    sum(pediatric_bed_occupied),
+    sum(beds_covid),
+    sum(icu_covid),
+    sum(adult_beds) FILTER (WHERE adult_beds IS NOT NULL
+                            AND beds_covid IS NOT NULL),
+    sum(beds_covid) FILTER (WHERE adult_beds IS NOT NULL
+                            AND beds_covid IS NOT NULL)
+FROM weekly
+WHERE collection_week = ANY(%s)
+GROUP BY collection_week;"""
+
+# Catalog entries of some weeks, from their fresh weekly_rollup rows
+CATALOG_REFRESH = """
+INSERT INTO week_catalog (collection_week, row_count)
+SELECT collection_week, hospital_records
+FROM weekly_rollup
+WHERE collection_week = ANY(%s)
+ON CONFLICT (collection_week) DO UPDATE SET
+    row_count = EXCLUDED.row_count,
+    last_loaded_at = now();"""
+
+# Count the dataset publishes for values suppressed to protect privacy
+SUPPRESSED = -999999
+
+# Geocoded addresses look like "POINT (-79.95 40.44)", longitude first
+POINT_PATTERN = r'^POINT \(([-+]?\d+\.\d+)\s+([-+]?\d+\.\d+)\)'
+
+# Schema applied when reading the file: only the columns the loader uses
+# are parsed. Ids and codes stay as text so that leading zeros survive,
+# bed counts are read straight into floats, and the few distinct states
+# and weeks are stored once as categories
+SCHEMA = {'hospital_pk': str,
+          'collection_week': 'category',
+          'state': 'category',
+          'hospital_name': str,
+          'address': str,
+          'zip': str,
+          'fips_code': str,
+          'geocoded_hospital_address': str,
+          **{col: 'float64' for col in cols}}
+NA_VALUES = ['', 'NA', 'N/A', 'NaN', 'nan', 'NULL']
+READ_OPTIONS = {"usecols": list(SCHEMA),
+                "dtype": SCHEMA,
+                "na_values": NA_VALUES,
+                "keep_default_na": False}
+
+
+def extract_lat_long(geo_addresses):
+    """Extracting Latitude and Longitude information for a whole column
+    Parameters
+    ----------
+    geo_addresses: pd.Series of strings of form "POINT (long lat)"
+
+    Returns
+    -------
+    pd.DataFrame with float columns latitude and longitude, NaN where the
+    address is "NA", NaN or doesn't match the format
+    """
+    points = geo_addresses.astype("string").str.extract(POINT_PATTERN)
+    return pd.DataFrame({"latitude": points[1].astype(float),
+                         "longitude": points[0].astype(float)},
+                        index=geo_addresses.index)
+
+
+def read(file_path, chunksize=None):
+    """Read an HHS dataset CSV.
+    Parameters
+    ----------
+    file_path : str
+        Path to the CSV file
+    chunksize : int, optional
+        Return an iterator over chunks of this many rows instead
+
+    Returns
+    -------
+    pd.DataFrame or pandas TextFileReader
+    """
+    return pd.read_csv(file_path, chunksize=chunksize, **READ_OPTIONS)
+
+
+def clean(df, seen=None):
+    """Clean raw HHS rows into the weekly and demo tables.
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Raw rows of the HHS dataset
+    seen : set, optional
+        Hospital ids already kept from earlier chunks of the same file.
+        Rows for these hospitals are dropped and the set is updated, so
+        chunked loading deduplicates like a whole-file load.
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame, pd.DataFrame)
+        Rows for the weekly table and rows for the demo table, named like
+        the table columns, and rows breaking a table constraint (see
+        validate.split)
+    """
+    # Unique hospital id
+    df = df[df['hospital_pk'].str.match(r'^\d{6}$', na=False)]
+    df = df.dropna(subset=['hospital_pk', 'collection_week'])
+    df = df.drop_duplicates(subset=['hospital_pk'])
+    if seen is not None:
+        df = df[~df['hospital_pk'].isin(seen)]
+        seen.update(df['hospital_pk'])
+    # Collection date
+    df['collection_week'] = pd.to_datetime(df['collection_week'])
+
+    # Suppressed counts are missing values; any other negative count, or
+    # occupied beds above the total, breaks a CHECK and is rejected below
+    df[cols] = df[cols].mask(df[cols] == SUPPRESSED)
+
+    # Weekly table copy
+    df1 = df[['hospital_pk', 'collection_week'] + cols].rename(
+        columns=WEEKLY_NAMES)
+
+    # Demo table copy
+    df2 = df[['hospital_pk'] + cols_demo].rename(columns=DEMO_NAMES)
+
+    # Parse the whole geocoded_hospital_address column at once
+    df2[['latitude', 'longitude']] = extract_lat_long(
+        df2['geocoded_hospital_address'])
+    df2 = df2.drop(columns='geocoded_hospital_address')
+
+    # Positions that don't fit their column are dropped, rows that would
+    # still break a table constraint are set aside
+    df2 = validate.clear(df2, validate.DEMO_CLEARED)
+    df2, demo_rejects = validate.split(df2, "demo", validate.DEMO_RULES)
+    weekly_rules = validate.WEEKLY_RULES + [
+        ("weekly_hospital_id_fkey",
+         validate.references("hospital_id", df2['id']))]
+    df1, weekly_rejects = validate.split(df1, "weekly", weekly_rules)
+    return df1, df2, pd.concat([demo_rejects, weekly_rejects],
+                               ignore_index=True)
+
+
+def drop_loaded(conn, df1, df2):
+    """Drop rows that an earlier load already put in the database.
+    Parameters
+    ----------
+    conn : psycopg connection
+    df1 : pd.DataFrame
+        Rows for the weekly table
+    df2 : pd.DataFrame
+        Rows for the demo table
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame)
+        Weekly rows whose hospital and week are not in the database yet,
+        and demo rows for the hospitals among them
+    """
+    weeks = pd.to_datetime(df1['collection_week']).dt.date
+    loaded = conn.execute(
+        "SELECT hospital_id, collection_week FROM weekly "
+        "WHERE collection_week = ANY(%s);",
+        [sorted(weeks.unique())]).fetchall()
+    conn.commit()
+    if loaded:
+        keys = pd.MultiIndex.from_arrays([df1['hospital_id'], weeks])
+        df1 = df1[~keys.isin(loaded)]
+        df2 = df2[df2['id'].isin(df1['hospital_id'])]
+    return df1, df2
+
+
+def refresh_catalog(conn, weeks):
+    """Recompute the week_catalog entries of some collection weeks from
+    their weekly_rollup rows, without committing.
+    Parameters
+    ----------
+    conn : psycopg connection
+    weeks : list of datetime.date
+    """
+    # Weeks no longer in weekly leave the catalog
+    conn.execute("DELETE FROM week_catalog WHERE collection_week = ANY(%s) "
+                 "AND collection_week NOT IN "
+                 "(SELECT collection_week FROM weekly_rollup);", [weeks])
+    conn.execute(CATALOG_REFRESH, [weeks])
+
+
+def refresh_rollup(conn, weeks):
+    """Recompute the weekly_rollup rows and week_catalog entries of some
+    collection weeks from the weekly table, in one transaction.
+    Parameters
+    ----------
+    conn : psycopg connection
+    weeks : iterable of datetime.date
+        Collection weeks whose weekly rows changed
+    """
+    weeks = sorted(set(weeks))
+    if not weeks:
+        return
+    refresh_rows(conn, "weekly_rollup", ROLLUP_REFRESH, [weeks],
+                 "collection_week", weeks,
+                 lambda conn: refresh_catalog(conn, weeks))
+
+
+def write(conn, df1, df2, write_rows):
+    """Write cleaned rows into the demo table, then the weekly table.
+    Parameters
+    ----------
+    conn : psycopg connection
+    df1 : pd.DataFrame
+        Rows for the weekly table
+    df2 : pd.DataFrame
+        Rows for the demo table
+    write_rows : callable
+        writers.insert_rows or writers.copy_rows
+
+    Returns
+    -------
+    (int, int)
+        Number of rows written into demo and into weekly, None for a
+        table whose write failed and was rolled back
+    """
+    demo_count = weekly_count = 0
+
+    # Convert float("NaN") type to python None type
+    df1 = df1.astype(object).where(df1.notna(), None)
+    df2 = df2.astype(object).where(df2.notna(), None)
+
+    # Insert into demo table
+    cur_demo = conn.cursor()
+    # Covert the dataset to list of tuples for batch insert
+    demo = list(df2[DEMO_COLUMNS].itertuples(index=False, name=None))
+    try:
+        demo_count = write_rows(cur_demo, "demo", DEMO_COLUMNS, demo,
+                                DEMO_CONFLICT)
+
+    except Exception as err:
+        rowcount = cur_demo.rowcount
+        print(err, " at row ", rowcount)
+        conn.rollback()
+        demo_count = None
+
+    else:
+        conn.commit()
+
+    # Insert into weekly table
+    cur_weekly = conn.cursor()
+    weekly = list(df1[WEEKLY_COLUMNS].itertuples(index=False, name=None))
+
+    try:
+        # A partitioned weekly table needs a partition for every week
+        schema.ensure_partitions(conn, df1['collection_week'])
+        weekly_count = write_rows(cur_weekly, "weekly", WEEKLY_COLUMNS,
+                                  weekly, WEEKLY_CONFLICT)
+
+    except Exception as err:
+        rowcount = cur_weekly.rowcount
+        print(err, " at row ", rowcount)
+        conn.rollback()
+        weekly_count = None
+
+    else:
+        conn.commit()
+
+    return demo_count, weekly_count
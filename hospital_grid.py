@@ -0,0 +1,136 @@
+"""Hospital counts on grids of several resolutions for the emergency
+services map
+
+Zoomed out, the map draws one circle per grid cell instead of one per
+hospital: every cell of the coarsest grid, then the cells in view of
+finer ones, so it sends about as many circles whatever the number of
+hospitals loaded. Zoomed in past the finest grid, it draws the hospitals
+in view. The loaders recompute the grid from demo once they have
+written their files.
+"""
+import math
+from writers import refresh_rows
+
+# Size in degrees of the cells of each resolution, coarsest first
+CELL_DEGREES = {1: 2.0, 2: 0.5, 3: 0.125}
+
+# Highest map zoom level drawn with each resolution. The coarsest grid
+# has few cells and is drawn whole. On the finer ones, a viewport of
+# MAP_WIDTH pixels spans about 1400 / 2 ** zoom degrees of longitude, so
+# it holds at most about 44 cells across; further in than the last level
+# the map draws hospitals
+MIN_ZOOM = 4
+MAX_ZOOM = {1: 5, 2: 7, 3: 9}
+
+# Size of the map on the page in pixels, for the extent of the viewport
+MAP_WIDTH = 1000
+MAP_HEIGHT = 500
+
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0
+
+GRID_REFRESH = """
+INSERT INTO hospital_grid (resolution, cell_lat, cell_lon, state,
+                           emergency_service, hospitals, latitude_sum,
+                           longitude_sum)
+SELECT
+    grid.resolution,
+    CAST(floor(latitude / grid.degrees) AS INTEGER),
+    CAST(floor(longitude / grid.degrees) AS INTEGER),
+    coalesce(state, ''),
+    coalesce(emergency_service, FALSE),
+    count(*),
+    sum(latitude),
+    sum(longitude)
+FROM demo
+CROSS JOIN unnest(%s::smallint[], %s::double precision[])
+    AS grid (resolution, degrees)
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5;"""
+
+
+def refresh(conn):
+    """Recompute every cell of the hospital_grid table from the demo
+    table, in one transaction.
+    Parameters
+    ----------
+    conn : psycopg connection
+    """
+    refresh_rows(conn, "hospital_grid", GRID_REFRESH,
+                 [list(CELL_DEGREES), list(CELL_DEGREES.values())])
+
+
+def resolution(zoom):
+    """Grid resolution the map draws at a zoom level.
+    Parameters
+    ----------
+    zoom : int
+
+    Returns
+    -------
+    int or None
+        Key of CELL_DEGREES, None when the map draws hospitals
+    """
+    for level, max_zoom in MAX_ZOOM.items():
+        if zoom <= max_zoom:
+            return level
+    return None
+
+
+def viewport(latitude, longitude, zoom):
+    """Bounding box of the map centered on a position at a zoom level.
+    Parameters
+    ----------
+    latitude : float
+    longitude : float
+    zoom : int
+
+    Returns
+    -------
+    (float, float, float, float)
+        South, north, west and east edges, in degrees
+    """
+    # The whole world is 256 pixels wide at zoom 0, twice that at each
+    # level, and Web Mercator stretches latitudes towards the poles
+    world = 256 * 2 ** zoom
+    half_width = MAP_WIDTH / 2 / world * 360
+    half_height = MAP_HEIGHT / 2 / world * 2 * math.pi
+    y = math.asinh(math.tan(math.radians(latitude)))
+    south = math.degrees(math.atan(math.sinh(y - half_height)))
+    north = math.degrees(math.atan(math.sinh(y + half_height)))
+    return (max(-MAX_LATITUDE, south), min(MAX_LATITUDE, north),
+            max(-180.0, longitude - half_width),
+            min(180.0, longitude + half_width))
+
+
+def cells(bbox, level):
+    """Range of the cells of a resolution covering a bounding box.
+    Parameters
+    ----------
+    bbox : (float, float, float, float)
+        South, north, west and east edges, as viewport returns them
+    level : int
+        Key of CELL_DEGREES
+
+    Returns
+    -------
+    (int, int, int, int)
+        First and last cell_lat, first and last cell_lon
+    """
+    south, north, west, east = bbox
+    degrees = CELL_DEGREES[level]
+    return (math.floor(south / degrees), math.floor(north / degrees),
+            math.floor(west / degrees), math.floor(east / degrees))
+
+
+def extent(cells, level):
+    """Bounding box of a range of cells of a resolution, see cells.
+    Returns
+    -------
+    (float, float, float, float)
+        South, north, west and east edges, in degrees
+    """
+    lat_first, lat_last, lon_first, lon_last = cells
+    degrees = CELL_DEGREES[level]
+    return (lat_first * degrees, (lat_last + 1) * degrees,
+            lon_first * degrees, (lon_last + 1) * degrees)
@@ -1,167 +1,112 @@
 """Import HHS dataset"""
-import sys
-import pandas as pd
-import psycopg
-import re
-import credentials
-
-
-# Load hhs dataset
-file_path = str(sys.argv[1])
-df = pd.read_csv(file_path)
-
-# Unique hospital id
-df = df[df['hospital_pk'].str.match(r'^\d{6}$')]
-df = df.dropna(subset=['hospital_pk', 'collection_week'])
-df = df.drop_duplicates(subset=['hospital_pk'])
-# Collection date
-df['collection_week'] = pd.to_datetime(df['collection_week'])
-
-# Columns for weekly table
-cols = ['all_adult_hospital_beds_7_day_avg',
-        'all_adult_hospital_inpatient_bed_occupied_7_day_avg',
-        'all_pediatric_inpatient_beds_7_day_avg',
-        'all_pediatric_inpatient_bed_occupied_7_day_avg',
-        'total_icu_beds_7_day_avg',
-        'icu_beds_used_7_day_avg',
-        'inpatient_beds_used_covid_7_day_avg',
-        'staffed_icu_adult_patients_confirmed_covid_7_day_avg']
-df[cols] = df[cols].where(df[cols] >= 0, None)
-df[cols] = df[cols].where(df[cols] != 'NA', None)
-
-# Weekly table copy
-df1 = df[['hospital_pk', 'collection_week'] + cols].copy()
-# Check that occupied <= total
-df1.iloc[df1.iloc[:, 3] > df1.iloc[:, 2], [2, 3]] = None
-df1.iloc[df1.iloc[:, 5] > df1.iloc[:, 4], [4, 5]] = None
-df1.iloc[df1.iloc[:, 7] > df1.iloc[:, 6], [6, 7]] = None
-df1.iloc[df1.iloc[:, 9] > df1.iloc[:, 7], [7, 9]] = None
-df1.iloc[:, 8] = df1.iloc[:, 8].where(
-    df1.iloc[:, 8] <= (df1.iloc[:, 3] + df1.iloc[:, 5]), None)
-
-# Columns for demo table
-cols_demo = [
-        'hospital_name',
-        'address',
-        'zip',
-        'fips_code',
-        'state',
-        'geocoded_hospital_address'
-]
-
-# Demo table copy
-df2 = df[['hospital_pk'] + cols_demo].copy()
-
-
-def extract_lat_long(geo_address):
-    """Extracting Latitude and Longitude information
-    Parameters
-    ----------
-    geo_address: tuple of form (long, lat)
-
-    Returns
-    -------
-    pd.Series([float, float])
-    """
-    if geo_address == "NA":
-        return pd.Series([None, None])
-    elif pd.notna(geo_address):
-        match = re.match(r'POINT \(([-+]?\d+\.\d+)\s+([-+]?\d+\.\d+)\)',
-                         geo_address)
-        if match:
-            longitude, latitude = map(float, match.groups())
-            return pd.Series([latitude, longitude])
-    # Return None if geo_address is NaN or doesn't match the format
-    return pd.Series([None, None])
-
-
-# Apply the function to the geocoded_hospital_address column
-df2[['latitude', 'longitude']] = df2['geocoded_hospital_address'].apply(
-    extract_lat_long)
-
-# Rename the fips column
-df2 = df2.rename(columns={'fips_code': 'fips'})
-
-# Convert float("NaN") type to python None type
-df1 = df1.replace({float("NaN"): None})
-df2 = df2.replace({float("NaN"): None})
-
+import argparse
+import db
+import hhs
+import hospital_grid
+import loader_cache
+import manifest
+import validate
+from writers import copy_rows, insert_rows
+
+
+# Command line arguments
+parser = argparse.ArgumentParser(description="Load an HHS weekly CSV file")
+parser.add_argument("file_path", help="path to the HHS dataset CSV")
+parser.add_argument("--copy", action="store_true",
+                    help="bulk load through COPY and staging tables "
+                         "instead of row-by-row inserts")
+parser.add_argument("--chunksize", type=int,
+                    help="stream the file in chunks of this many rows, "
+                         "writing each chunk before reading the next")
+parser.add_argument("--force", action="store_true",
+                    help="load the file even if the load manifest says it "
+                         "was already loaded, and resend rows already in "
+                         "the database")
+parser.add_argument("--cache", metavar="DIR",
+                    help="reuse cleaned rows from a columnar cache in DIR "
+                         "keyed by the file's checksum, writing them there "
+                         "on a cache miss")
+args = parser.parse_args()
 
 # Read data into tables
-conn = psycopg.connect(
-   host="pinniped.postgres.database.azure.com",
-   dbname=credentials.DB_USER,
-   user=credentials.DB_USER,
-   password=credentials.DB_PASSWORD
-)
-
-# Insert into demo table
-cur_demo = conn.cursor()
-# Covert the dataset to list of tuples for batch insert
-demo = [(row.hospital_pk, row.hospital_name, row.state,
-         row.address, row.zip,
-         row.fips, row.latitude, row.longitude,) for row in df2.itertuples(
-             index=False)]
-try:
-    # Update the demographics information when we see the same hospital id
-    cur_demo.executemany(
-        "INSERT INTO demo"
-        "(id, name, state, address, zip, fips, latitude, longitude)"
-        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-        "ON CONFLICT (id) DO UPDATE SET "
-        "name = EXCLUDED.name,"
-        "state = EXCLUDED.state,"
-        "address = EXCLUDED.address,"
-        "zip = EXCLUDED.zip,"
-        "fips = EXCLUDED.fips,"
-        "latitude = EXCLUDED.latitude,"
-        "longitude = EXCLUDED.longitude;",
-        demo
-    )
-    # Print the number of rows inserted
-    rowcount = cur_demo.rowcount
-    print(rowcount, " rows have been inserted into database demo")
-
-except Exception as err:
-    rowcount = cur_demo.rowcount
-    print(err, " at row ", rowcount)
-
-else:
-    conn.commit()
-
-# Insert into weekly table
-cur_weekly = conn.cursor()
-weekly = [(row.hospital_pk,
-           row.collection_week,
-           row.all_adult_hospital_beds_7_day_avg,
-           row.all_adult_hospital_inpatient_bed_occupied_7_day_avg,
-           row.all_pediatric_inpatient_beds_7_day_avg,
-           row.all_pediatric_inpatient_bed_occupied_7_day_avg,
-           row.total_icu_beds_7_day_avg,
-           row.icu_beds_used_7_day_avg,
-           row.inpatient_beds_used_covid_7_day_avg,
-           row.staffed_icu_adult_patients_confirmed_covid_7_day_avg
-           ) for row in df1.itertuples(index=False)]
-
-try:
-    cur_weekly.executemany(
-        "INSERT INTO weekly"
-        "(hospital_id, collection_week, adult_beds, adult_bed_occupied, \
-          pediatric_beds, pediatric_bed_occupied, icu_beds, icu_bed_occupied,\
-                beds_covid, icu_covid)"
-        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        "ON CONFLICT (hospital_id, collection_week) DO NOTHING;",
-        weekly
-    )
-    rowcount = cur_weekly.rowcount
-    print(rowcount, " rows have been inserted into database weekly")
-
-except Exception as err:
-    rowcount = cur_weekly.rowcount
-    print(err, " at row ", rowcount)
-
-else:
-    conn.commit()
-
+conn = db.connect()
+
+# Skip files that were already loaded, before parsing anything
+checksum = manifest.file_checksum(args.file_path)
+loaded_at = manifest.find_load(conn, "hhs", checksum)
+if loaded_at is not None and not args.force:
+    print(f"{args.file_path} was already loaded on {loaded_at}, skipping")
+    conn.close()
+    raise SystemExit(0)
+
+write_rows = copy_rows if args.copy else insert_rows
+
+
+def cleaned_frames():
+    """Rows read, cleaned weekly and demo rows and rejected rows for each
+    chunk of the file, from the cache when it has them."""
+    if args.cache:
+        entry = loader_cache.entry_path(args.cache, "hhs", checksum)
+        meta = loader_cache.read_meta(entry)
+        if meta is not None:
+            # Replay cleaned rows without parsing the CSV
+            for i, frames in enumerate(loader_cache.read_parts(
+                    entry, ["weekly", "demo", "rejects"])):
+                yield (meta["rows_read"] if i == 0 else 0, *frames)
+            return
+        cache = loader_cache.EntryWriter(args.cache, "hhs", checksum,
+                                         args.file_path)
+
+    if args.chunksize:
+        # Only one chunk of the file is held in memory at a time
+        frames = hhs.read(args.file_path, chunksize=args.chunksize)
+        seen = set()
+    else:
+        # Load hhs dataset
+        frames = [hhs.read(args.file_path)]
+        seen = None
+    for df in frames:
+        df1, df2, rejects = hhs.clean(df, seen)
+        if args.cache:
+            cache.add(len(df), {"weekly": df1, "demo": df2,
+                                "rejects": rejects})
+        yield len(df), df1, df2, rejects
+    if args.cache:
+        cache.close()
+
+
+rows_read = demo_total = weekly_total = rejected = 0
+weeks = set()
+failed = False
+for rows, df1, df2, rejects in cleaned_frames():
+    rows_read += rows
+    # Rows breaking a table constraint are kept aside, not loaded
+    validate.record_rejects(conn, "hhs", args.file_path, rejects)
+    rejected += len(rejects)
+    weeks.update(df1['collection_week'].dt.date)
+    if not args.force:
+        # Only send hospitals and weeks not already in the database
+        df1, df2 = hhs.drop_loaded(conn, df1, df2)
+    demo_count, weekly_count = hhs.write(conn, df1, df2, write_rows)
+    failed = failed or demo_count is None or weekly_count is None
+    demo_total += demo_count or 0
+    weekly_total += weekly_count or 0
+
+# Recompute the dashboard's per-week sums for the weeks of this file,
+# and the map grid from the hospitals
+hhs.refresh_rollup(conn, weeks)
+hospital_grid.refresh(conn)
+if demo_total or weekly_total:
+    manifest.bump_data_version(conn)
+
+# Print the number of rows inserted
+print(demo_total, " rows have been inserted into database demo")
+print(weekly_total, " rows have been inserted into database weekly")
+if rejected:
+    print(rejected, " rows were rejected, see table load_rejects")
+
+if not failed:
+    manifest.record_load(conn, "hhs", args.file_path, checksum, rows_read,
+                         demo_total, weekly_total, weeks)
 
 conn.close()
@@ -1,99 +1,94 @@
 """Upload the hospital quality dataset"""
-import sys
-import pandas as pd
-import psycopg
-import credentials
+import argparse
+import db
+import hospital_grid
+import loader_cache
+import manifest
+import quality
+import validate
 from datetime import datetime
 
-# Getting values from command line argument
-if len(sys.argv) < 3:
-    raise ValueError("Provide the date of data and pathname of file to read")
-
-date = sys.argv[1]
-filepath = sys.argv[2]
-
-# Reading dataframe
-df = pd.read_csv(filepath)
-names_dict = {'Facility ID': "hospital_id",
-              'Hospital Type': "type_of_hospital",
-              'Hospital Ownership': "type_of_ownership",
-              'Emergency Services': "emergency_service",
-              'Hospital overall rating': "quality_score"}
-df.rename(columns=names_dict, inplace=True)
-
-# Cleaning data for Unique hospital id
-df = df[df['hospital_id'].str.match(r'^\d{6}$')]
-df = df.dropna(subset=['hospital_id'])
-df = df.drop_duplicates(subset=['hospital_id'])
-
-# Convert float("NaN") type to python None type
-df = df.replace({float("NaN"): None})
-
-# Cleaning data to add to quality table
-df_quality = df[["hospital_id", "quality_score"]]
-df_quality = df_quality[df_quality.quality_score != 'Not Available']
-df_quality.quality_score = df_quality.quality_score.astype(int)
-
-date = datetime.strptime(date, "%Y-%m-%d").date()
-df_quality["date"] = date
-
-list_quality = [(row.hospital_id, row.date,  row.quality_score) for row in
-                df_quality.itertuples(index=False)]
-
-# Opening connection to database
-conn = psycopg.connect(
-   host="pinniped.postgres.database.azure.com",
-   dbname=credentials.DB_USER,
-   user=credentials.DB_USER,
-   password=credentials.DB_PASSWORD
-)
-
-cur = conn.cursor()
-
-# Writing into "demo" database
-try:
-
-    cur.executemany("""
-       INSERT INTO demo (id, type_of_hospital, type_of_ownership, \
-                    emergency_service)
-       VALUES (%s, %s, %s, %s)
-       ON CONFLICT (id)
-       DO UPDATE SET
-           type_of_hospital = EXCLUDED.type_of_hospital,
-           type_of_ownership = EXCLUDED.type_of_ownership,
-           emergency_service = EXCLUDED.emergency_service;
-       """, [
-           (row.hospital_id, row.type_of_hospital, row.type_of_ownership,
-            row.emergency_service)
-           for row in df.itertuples(index=False)
-       ])
-
-    # Print the result
-    print(f"{cur.rowcount} rows have been inserted or updated" +
-          " in the database \"demo\".")
-
-except Exception as err:
-    # Stop transaction in case of error, prints current rowcount
-    print(err, " at row ", cur.rowcount)
-else:
-    conn.commit()
-
-
-# Writing into the "quality" database
+# Command line arguments
+parser = argparse.ArgumentParser(
+    description="Load a hospital quality CSV file")
+parser.add_argument("date", help="date of the data, as YYYY-MM-DD")
+parser.add_argument("file_path", help="path to the quality dataset CSV")
+parser.add_argument("--copy", action="store_true",
+                    help="bulk load both tables through one staging table "
+                         "and one transaction")
+parser.add_argument("--force", action="store_true",
+                    help="load the file even if the load manifest says it "
+                         "was already loaded for this date, and resend "
+                         "hospitals already scored for it")
+parser.add_argument("--cache", metavar="DIR",
+                    help="reuse cleaned rows from a columnar cache in DIR "
+                         "keyed by the file's checksum, writing them there "
+                         "on a cache miss")
+args = parser.parse_args()
 try:
-    cur.executemany("""INSERT INTO quality (hospital_id, date, quality_score)
-                    VALUES (%s, %s, cast(%s as integer))
-                    ON CONFLICT (hospital_id, date) DO NOTHING;""",
-                    list_quality)
-    rowcount = cur.rowcount
-    print(rowcount, " rows have been inserted into database \"quality\".")
+    data_date = datetime.strptime(args.date, "%Y-%m-%d").date()
+except ValueError:
+    parser.error(f"date {args.date!r} is not formatted as YYYY-MM-DD")
 
-except Exception as err:
-    # Stops transaction in case of error, prints current rowcount
-    rowcount = cur.rowcount
-    print(err, " at row ", rowcount)
+# Opening connection to database
+conn = db.connect()
+
+# Skip files that were already loaded for this date, before parsing anything
+checksum = manifest.file_checksum(args.file_path)
+loaded_at = manifest.find_load(conn, "quality", checksum, data_date)
+if loaded_at is not None and not args.force:
+    print(f"{args.file_path} was already loaded on {loaded_at}, skipping")
+    conn.close()
+    raise SystemExit(0)
+
+entry = None
+if args.cache:
+    entry = loader_cache.entry_path(args.cache, "quality", checksum, data_date)
+meta = loader_cache.read_meta(entry) if entry else None
+if meta is not None:
+    # Replay cleaned rows without parsing the CSV
+    (df, df_quality, rejects), = loader_cache.read_parts(
+        entry, ["demo", "quality", "rejects"])
+    rows_read = meta["rows_read"]
 else:
-    conn.commit()
-
+    # Reading and cleaning dataframe
+    raw = quality.read(args.file_path)
+    rows_read = len(raw)
+    df, df_quality, rejects = quality.clean(raw, args.date)
+    if args.cache:
+        cache = loader_cache.EntryWriter(args.cache, "quality", checksum,
+                                         args.file_path, data_date)
+        cache.add(rows_read, {"demo": df, "quality": df_quality,
+                              "rejects": rejects})
+        cache.close()
+
+# Rows breaking a table constraint are kept aside, not loaded
+validate.record_rejects(conn, "quality", args.file_path, rejects)
+
+# Hospitals whose rating intervals are refreshed, including those an
+# interrupted earlier load already wrote
+hospitals = df_quality['hospital_id']
+if not args.force:
+    # Only send hospitals not already scored for this date
+    df, df_quality = quality.drop_loaded(conn, df, df_quality)
+
+write = quality.copy_write if args.copy else quality.write
+demo_count, quality_count = write(conn, df, df_quality)
+quality.refresh_asof(conn, hospitals)
+hospital_grid.refresh(conn)
+if demo_count or quality_count:
+    manifest.bump_data_version(conn)
+
+# Print the result
+print(f"{demo_count or 0} rows have been inserted or updated" +
+      " in the database \"demo\".")
+print(quality_count or 0,
+      " rows have been inserted into database \"quality\".")
+if len(rejects):
+    print(len(rejects), " rows were rejected, see table load_rejects")
+
+if demo_count is not None and quality_count is not None:
+    manifest.record_load(conn, "quality", args.file_path, checksum, rows_read,
+                         demo_count, quality_count, [data_date])
 
 conn.close()
@@ -0,0 +1,159 @@
+"""Columnar cache of cleaned loader output, keyed by input file checksum
+
+Each cached file is a directory holding one Parquet file per table and
+chunk, plus a meta.json describing where it came from and which
+version of the cleaning wrote it. Writing Parquet needs pyarrow
+installed.
+"""
+import glob
+import json
+import os
+import shutil
+from datetime import datetime
+import pandas as pd
+
+# Version of the cleaning done by hhs.clean and quality.clean. Bump it
+# whenever their output changes; entries written by another version are
+# treated as missing, so the files are cleaned again
+CLEAN_VERSION = 3
+
+
+def entry_path(cache_dir, dataset, checksum, date=None):
+    """Directory of the cache entry for one input file.
+    Parameters
+    ----------
+    cache_dir : str
+    dataset : str
+        "hhs" or "quality"
+    checksum : str
+        Checksum of the input file
+    date : datetime.date, optional
+        Date of a quality file, which is part of its cleaned output
+
+    Returns
+    -------
+    str
+    """
+    name = f"{dataset}-{checksum}"
+    if date is not None:
+        name = f"{dataset}-{date:%Y-%m-%d}-{checksum}"
+    return os.path.join(cache_dir, name)
+
+
+class EntryWriter:
+    """Write the cleaned chunks of one input file into a cache entry.
+
+    The entry only becomes visible once close() is called, so an
+    interrupted load never leaves a partial entry behind.
+    """
+
+    def __init__(self, cache_dir, dataset, checksum, file_path, date=None):
+        self.path = entry_path(cache_dir, dataset, checksum, date)
+        self.tmp_path = self.path + ".tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.meta = {"clean_version": CLEAN_VERSION,
+                     "dataset": dataset,
+                     "checksum": checksum,
+                     "file_name": os.path.basename(file_path),
+                     "file_size": os.path.getsize(file_path),
+                     "date": None if date is None else f"{date:%Y-%m-%d}",
+                     "rows_read": 0,
+                     "weeks": [],
+                     "parts": 0}
+
+    def add(self, rows_read, frames):
+        """Add one cleaned chunk.
+        Parameters
+        ----------
+        rows_read : int
+            Rows read from the input file for this chunk
+        frames : dict of str to pd.DataFrame
+            Cleaned rows by table name
+        """
+        part = self.meta["parts"]
+        for table, frame in frames.items():
+            frame.to_parquet(
+                os.path.join(self.tmp_path, f"{table}-{part:05d}.parquet"),
+                index=False)
+        if "weekly" in frames:
+            weeks = set(self.meta["weeks"]) | set(
+                frames["weekly"]["collection_week"].dt.strftime("%Y-%m-%d"))
+            self.meta["weeks"] = sorted(weeks)
+        self.meta["rows_read"] += rows_read
+        self.meta["parts"] += 1
+
+    def close(self):
+        """Publish the entry."""
+        self.meta["created"] = datetime.now().isoformat(timespec="seconds")
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.rename(self.tmp_path, self.path)
+
+
+def read_meta(path):
+    """Metadata of a cache entry, None if there is no complete entry or
+    it was written by another version of the cleaning.
+    Parameters
+    ----------
+    path : str
+        Entry directory
+
+    Returns
+    -------
+    dict or None
+    """
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if meta.get("clean_version") != CLEAN_VERSION:
+        print(f"{path} was written by another version of the cleaning, "
+              "ignored")
+        return None
+    return meta
+
+
+def read_parts(path, tables):
+    """Iterate over the cached chunks of an entry.
+    Parameters
+    ----------
+    path : str
+        Entry directory
+    tables : list of str
+        Table names, in the order they are returned for each chunk
+
+    Yields
+    ------
+    tuple of pd.DataFrame
+        One frame per table
+    """
+    for part in range(read_meta(path)["parts"]):
+        yield tuple(
+            pd.read_parquet(os.path.join(path, f"{table}-{part:05d}.parquet"))
+            for table in tables)
+
+
+def entries(cache_dir):
+    """All complete cache entries, HHS files by first collection week
+    followed by quality files by date.
+    Parameters
+    ----------
+    cache_dir : str
+
+    Returns
+    -------
+    list of (str, dict)
+        Entry directory and its metadata
+    """
+    found = []
+    for path in glob.glob(os.path.join(cache_dir, "*")):
+        meta = read_meta(path) if os.path.isdir(path) else None
+        if meta is not None:
+            found.append((path, meta))
+    return sorted(found, key=lambda entry: (
+        entry[1]["dataset"] != "hhs",
+        entry[1]["date"] or min(entry[1]["weeks"], default=""),
+        entry[1]["file_name"]))
@@ -0,0 +1,97 @@
+"""Load manifest recording which files have been ingested"""
+import hashlib
+import os
+
+
+def file_checksum(file_path):
+    """SHA-256 checksum of a file's contents.
+    Parameters
+    ----------
+    file_path : str
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_load(conn, dataset, checksum, week=None):
+    """Look up an earlier load of the same file.
+    Parameters
+    ----------
+    conn : psycopg connection
+    dataset : str
+        "hhs" or "quality"
+    checksum : str
+        Checksum of the file
+    week : datetime.date, optional
+        Only match loads covering this date, for files whose date is
+        given on the command line
+
+    Returns
+    -------
+    datetime.datetime or None
+        When the file was loaded, None if it never was
+    """
+    query = ("SELECT loaded_at FROM load_manifest "
+             "WHERE dataset = %s AND checksum = %s")
+    params = [dataset, checksum]
+    if week is not None:
+        query += " AND %s = ANY(weeks)"
+        params.append(week)
+    row = conn.execute(query + " ORDER BY loaded_at DESC LIMIT 1;",
+                       params).fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def record_load(conn, dataset, file_path, checksum, rows_read, demo_rows,
+                data_rows, weeks, file_size=None):
+    """Record a completed load of a file.
+    Parameters
+    ----------
+    conn : psycopg connection
+    dataset : str
+        "hhs" or "quality"
+    file_path : str
+    checksum : str
+        Checksum of the file
+    rows_read : int
+        Rows read from the file, before cleaning
+    demo_rows : int
+        Rows inserted or updated in demo
+    data_rows : int
+        Rows inserted into weekly or quality
+    weeks : iterable of datetime.date
+        Collection weeks, or quality dates, covered by the file
+    file_size : int, optional
+        Size of the file in bytes, by default read from file_path
+    """
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+    conn.execute(
+        "INSERT INTO load_manifest (dataset, file_name, checksum, file_size, "
+        "rows_read, demo_rows, data_rows, weeks) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s);",
+        [dataset, os.path.basename(file_path), checksum,
+         file_size, rows_read, demo_rows, data_rows,
+         sorted(set(weeks))])
+    conn.commit()
+
+
+def bump_data_version(conn):
+    """Record that a load changed the data, once its writes are committed,
+    so that the dashboard caches drop results read before it.
+    Parameters
+    ----------
+    conn : psycopg connection
+    """
+    conn.execute("UPDATE data_version "
+                 "SET version = version + 1, changed_at = now();")
+    conn.commit()
@@ -0,0 +1,537 @@
+"""Versioned schema migrations
+
+Each migration brings the database from one schema version to the next
+and is recorded in the schema_version table once applied, so running
+them again only applies the new ones. Migrations never drop data: every
+statement is idempotent (IF NOT EXISTS), so a database created before
+the migrations existed, or a run interrupted half way, is brought up to
+date by running them again.
+
+A migration holds its own DDL and backfill SQL, as they were when it was
+written, and never calls the loaders' code, which keeps changing. It
+runs in one transaction, committed together with its schema_version row.
+Indexes on tables that already hold data are the exception: they are
+built concurrently, so loads and the dashboard keep running, before the
+transaction of their migration starts.
+
+To change the schema, append a migration to MIGRATIONS with the next
+version number; never edit or renumber one that was already applied.
+"""
+import re
+from datetime import date
+import schema
+
+create_version = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+);"""
+
+
+def concurrently(conn, indexes):
+    """Build indexes with CREATE INDEX CONCURRENTLY, outside of any
+    transaction, at the start of a migration.
+    Parameters
+    ----------
+    conn : psycopg connection
+    indexes : list of (str, str)
+        Names and definitions, see schema.build_indexes
+    """
+    conn.commit()
+    conn.autocommit = True
+    try:
+        schema.build_indexes(conn, indexes)
+    finally:
+        conn.autocommit = False
+
+
+# Migration 1
+create_demo = """
+CREATE TABLE IF NOT EXISTS demo (
+    id TEXT NOT NULL PRIMARY KEY,
+    name TEXT,
+    state TEXT,
+    address TEXT,
+    zip TEXT,
+    fips TEXT,
+    latitude DECIMAL(8, 6),
+    longitude DECIMAL(9, 6),
+    type_of_hospital TEXT,
+    type_of_ownership TEXT,
+    emergency_service BOOLEAN
+);"""
+
+create_quality = """
+CREATE TABLE IF NOT EXISTS quality (
+       id SERIAL PRIMARY KEY,
+       hospital_id TEXT NOT NULL REFERENCES demo (id),
+       date DATE NOT NULL,
+       quality_score INTEGER NOT NULL,
+       unique(hospital_id, date)
+);
+"""
+
+# Columns and constraints of weekly, shared by the plain and the
+# partitioned table
+weekly_columns = """
+    hospital_id TEXT NOT NULL REFERENCES demo (id),
+    collection_week DATE NOT NULL,
+    adult_beds DECIMAL CHECK (adult_beds >= 0),
+    adult_bed_occupied DECIMAL CHECK (adult_bed_occupied >= 0
+        AND adult_bed_occupied <= adult_beds),
+    pediatric_beds DECIMAL CHECK (pediatric_beds >= 0),
+    pediatric_bed_occupied DECIMAL CHECK (pediatric_bed_occupied >= 0
+        AND pediatric_bed_occupied <= pediatric_beds),
+    icu_beds DECIMAL CHECK (icu_beds >= 0),
+    icu_bed_occupied DECIMAL CHECK (icu_bed_occupied >= 0
+        AND icu_bed_occupied <= icu_beds),
+    beds_covid DECIMAL CHECK (beds_covid >= 0
+        AND beds_covid <= (adult_bed_occupied + pediatric_bed_occupied)),
+    icu_covid DECIMAL CHECK (icu_covid >= 0
+        AND icu_covid <= icu_bed_occupied),
+    unique(hospital_id, collection_week)"""
+
+create_weekly = f"""
+CREATE TABLE IF NOT EXISTS weekly (
+    id SERIAL PRIMARY KEY,{weekly_columns}
+);"""
+
+# Keys of a partitioned table must include the partition column
+create_weekly_partitioned = f"""
+CREATE TABLE IF NOT EXISTS weekly (
+    id SERIAL,{weekly_columns},
+    PRIMARY KEY (id, collection_week)
+) PARTITION BY RANGE (collection_week);"""
+
+
+def base_tables(conn, partition=None):
+    """Migration 1: the demo, quality and weekly tables."""
+    conn.execute(create_demo)
+    conn.execute(create_quality)
+    if partition is not None and conn.execute(
+            "SELECT to_regclass('weekly');").fetchone()[0] is None:
+        conn.execute(create_weekly_partitioned)
+        # Granularity is kept with the table for the loaders to read
+        conn.execute(f"COMMENT ON TABLE weekly IS 'partitions: {partition}';")
+    else:
+        conn.execute(create_weekly)
+
+
+# Migration 2
+create_manifest = """
+CREATE TABLE IF NOT EXISTS load_manifest (
+    id SERIAL PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    file_size BIGINT NOT NULL,
+    rows_read INTEGER NOT NULL,
+    demo_rows INTEGER NOT NULL,
+    data_rows INTEGER NOT NULL,
+    weeks DATE[] NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS load_manifest_checksum_idx
+    ON load_manifest (dataset, checksum);
+"""
+
+create_rejects = """
+CREATE TABLE IF NOT EXISTS load_rejects (
+    id SERIAL PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    failed_rule TEXT NOT NULL,
+    row_data JSONB NOT NULL,
+    rejected_at TIMESTAMP NOT NULL DEFAULT now()
+);"""
+
+
+def load_tables(conn, partition=None):
+    """Migration 2: the load_manifest and load_rejects tables."""
+    conn.execute(create_manifest)
+    conn.execute(create_rejects)
+
+
+# Migration 3
+dashboard_index_definitions = [
+    ("weekly_collection_week_idx", "ON weekly (collection_week)"),
+    ("quality_hospital_date_idx",
+     "ON quality (hospital_id, date DESC) INCLUDE (quality_score)"),
+    ("demo_geocoded_state_idx",
+     "ON demo (state, zip) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    ("demo_geocoded_zip_idx",
+     "ON demo (zip) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    ("demo_geocoded_emergency_idx",
+     "ON demo (state) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL "
+     "AND emergency_service"),
+]
+
+
+def dashboard_indexes(conn, partition=None):
+    """Migration 3: the indexes of the dashboard queries."""
+    concurrently(conn, dashboard_index_definitions)
+
+
+# Migration 4: per-week record counts and bed sums. The *_paired columns
+# only sum rows reporting both adult_beds and beds_covid, as plot 4 of
+# the dashboard does
+create_rollup = """
+CREATE TABLE IF NOT EXISTS weekly_rollup (
+    collection_week DATE PRIMARY KEY,
+    hospital_records INTEGER NOT NULL,
+    adult_beds NUMERIC,
+    adult_bed_occupied NUMERIC,
+    pediatric_beds NUMERIC,
+    pediatric_bed_occupied NUMERIC,
+    beds_covid NUMERIC,
+    icu_covid NUMERIC,
+    adult_beds_paired NUMERIC,
+    beds_covid_paired NUMERIC
+);"""
+
+fill_rollup = """
+INSERT INTO weekly_rollup
+SELECT collection_week,
+    count(*),
+    sum(adult_beds),
+    sum(adult_bed_occupied),
+    sum(pediatric_beds),
+    sum(pediatric_bed_occupied),
+    sum(beds_covid),
+    sum(icu_covid),
+    sum(adult_beds) FILTER (WHERE adult_beds IS NOT NULL
+                            AND beds_covid IS NOT NULL),
+    sum(beds_covid) FILTER (WHERE adult_beds IS NOT NULL
+                            AND beds_covid IS NOT NULL)
+FROM weekly
+GROUP BY collection_week;"""
+
+
+def weekly_rollup(conn, partition=None):
+    """Migration 4: the weekly_rollup table, filled from weekly."""
+    conn.execute(create_rollup)
+    conn.execute("LOCK TABLE weekly_rollup IN SHARE ROW EXCLUSIVE MODE;")
+    conn.execute("DELETE FROM weekly_rollup;")
+    conn.execute(fill_rollup)
+
+
+# Migration 5: validity interval of each quality rating. A score rated on
+# valid_from holds until the next rating of the hospital, valid_to,
+# exclusive; the latest rating is open-ended
+create_asof = """
+CREATE TABLE IF NOT EXISTS quality_asof (
+    hospital_id TEXT NOT NULL,
+    quality_score INTEGER NOT NULL,
+    valid_from DATE NOT NULL,
+    valid_to DATE NOT NULL DEFAULT 'infinity',
+    PRIMARY KEY (hospital_id, valid_from),
+    CHECK (valid_from < valid_to)
+);"""
+
+fill_asof = """
+INSERT INTO quality_asof (hospital_id, quality_score, valid_from, valid_to)
+SELECT hospital_id, quality_score, date,
+    COALESCE(LEAD(date) OVER (PARTITION BY hospital_id ORDER BY date),
+             'infinity')
+FROM quality;"""
+
+
+def quality_asof(conn, partition=None):
+    """Migration 5: the quality_asof table, filled from quality, and its
+    index, built with the table as nothing reads it yet."""
+    conn.execute(create_asof)
+    conn.execute("LOCK TABLE quality_asof IN SHARE ROW EXCLUSIVE MODE;")
+    conn.execute("DELETE FROM quality_asof;")
+    conn.execute(fill_asof)
+    conn.execute("CREATE INDEX IF NOT EXISTS quality_asof_valid_to_idx "
+                 "ON quality_asof (valid_to) "
+                 "INCLUDE (valid_from, hospital_id, quality_score);")
+    conn.execute("ANALYZE quality_asof;")
+
+
+# Migration 6: one row counting the loads that changed the data
+create_data_version = """
+CREATE TABLE IF NOT EXISTS data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT now()
+);
+INSERT INTO data_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+"""
+
+
+def data_version(conn, partition=None):
+    """Migration 6: the data_version table."""
+    conn.execute(create_data_version)
+
+
+# Migration 7: collection weeks loaded into weekly, with their row
+# counts and when a load first and last touched them
+create_catalog = """
+CREATE TABLE IF NOT EXISTS week_catalog (
+    collection_week DATE PRIMARY KEY,
+    row_count INTEGER NOT NULL,
+    first_loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    last_loaded_at TIMESTAMP NOT NULL DEFAULT now()
+);"""
+
+fill_catalog = """
+INSERT INTO week_catalog (collection_week, row_count, first_loaded_at,
+                          last_loaded_at)
+SELECT r.collection_week, r.hospital_records,
+    coalesce(min(m.loaded_at), now()),
+    coalesce(max(m.loaded_at), now())
+FROM weekly_rollup r
+LEFT JOIN load_manifest m
+    ON m.dataset = 'hhs' AND r.collection_week = ANY(m.weeks)
+GROUP BY r.collection_week, r.hospital_records
+ON CONFLICT (collection_week) DO NOTHING;"""
+
+
+def week_catalog(conn, partition=None):
+    """Migration 7: the week_catalog table, filled from weekly_rollup
+    with load times from load_manifest."""
+    conn.execute(create_catalog)
+    conn.execute(fill_catalog)
+
+
+# Migration 8
+zip_search_index_definitions = [
+    ("demo_geocoded_state_zip_prefix_idx",
+     "ON demo (state, zip text_pattern_ops) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    ("demo_geocoded_zip_prefix_idx",
+     "ON demo (zip text_pattern_ops) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+]
+
+
+def zip_search_indexes(conn, partition=None):
+    """Migration 8: the prefix indexes of the ZIP code search."""
+    concurrently(conn, zip_search_index_definitions)
+
+
+# Migration 9: geocoded hospitals counted per cell of grids of several
+# resolutions, per state and emergency service, with the sum of their
+# positions so a cell is drawn at their mean
+create_grid = """
+CREATE TABLE IF NOT EXISTS hospital_grid (
+    resolution SMALLINT NOT NULL,
+    cell_lat INTEGER NOT NULL,
+    cell_lon INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    emergency_service BOOLEAN NOT NULL,
+    hospitals INTEGER NOT NULL CHECK (hospitals > 0),
+    latitude_sum DOUBLE PRECISION NOT NULL,
+    longitude_sum DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (resolution, cell_lat, cell_lon, state, emergency_service)
+);"""
+
+fill_grid = """
+INSERT INTO hospital_grid (resolution, cell_lat, cell_lon, state,
+                           emergency_service, hospitals, latitude_sum,
+                           longitude_sum)
+SELECT
+    grid.resolution,
+    CAST(floor(latitude / grid.degrees) AS INTEGER),
+    CAST(floor(longitude / grid.degrees) AS INTEGER),
+    coalesce(state, ''),
+    coalesce(emergency_service, FALSE),
+    count(*),
+    sum(latitude),
+    sum(longitude)
+FROM demo
+CROSS JOIN (VALUES (1, CAST(2.0 AS DOUBLE PRECISION)), (2, 0.5),
+                   (3, 0.125))
+    AS grid (resolution, degrees)
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5;"""
+
+
+def grid(conn, partition=None):
+    """Migration 9: the position index of the zoomed in map, then the
+    hospital_grid table, filled from demo."""
+    concurrently(conn, [
+        ("demo_geocoded_position_idx",
+         "ON demo (latitude, longitude) "
+         "WHERE latitude IS NOT NULL AND longitude IS NOT NULL")])
+    conn.execute(create_grid)
+    conn.execute("LOCK TABLE hospital_grid IN SHARE ROW EXCLUSIVE MODE;")
+    conn.execute("DELETE FROM hospital_grid;")
+    conn.execute(fill_grid)
+
+
+# Migration 10
+def rejects_key(conn, partition=None):
+    """Migration 10: one load_rejects row per file, rule and row, keeping
+    the first of those recorded by earlier reruns."""
+    conn.execute("""
+        DELETE FROM load_rejects r
+        USING load_rejects first
+        WHERE first.dataset = r.dataset AND first.file_name = r.file_name
+            AND first.table_name = r.table_name
+            AND first.failed_rule = r.failed_rule
+            AND first.row_data = r.row_data AND first.id < r.id;""")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS load_rejects_row_key
+            ON load_rejects (dataset, file_name, table_name, failed_rule,
+                             md5(row_data::text));""")
+
+
+# Migration 11: granularity of the weekly partitions, in one row, rather
+# than in the comment migration 1 put on weekly
+create_partitioning = """
+CREATE TABLE IF NOT EXISTS weekly_partitioning (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    granularity TEXT NOT NULL
+        CHECK (granularity IN ('monthly', 'quarterly'))
+);"""
+
+
+def partitioning(conn, partition=None):
+    """Migration 11: the weekly_partitioning table, filled when weekly is
+    partitioned: from the comment on weekly, else from the bounds of one
+    of its partitions, else monthly as no week is stored yet."""
+    conn.execute(create_partitioning)
+    row = conn.execute(
+        "SELECT obj_description(partrelid, 'pg_class') "
+        "FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass('weekly');").fetchone()
+    if row is None:
+        return
+    found = re.search(r"partitions: (monthly|quarterly)", row[0] or "")
+    granularity = found.group(1) if found else "monthly"
+    bound = conn.execute(
+        "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'weekly'::regclass LIMIT 1;").fetchone()
+    if not found and bound is not None:
+        start, end = [date.fromisoformat(day) for day in
+                      re.findall(r"'(\d{4}-\d{2}-\d{2})'", bound[0])]
+        months = (end.year - start.year) * 12 + end.month - start.month
+        granularity = {1: "monthly", 3: "quarterly"}.get(months, "monthly")
+    conn.execute("INSERT INTO weekly_partitioning (granularity) "
+                 "VALUES (%s) ON CONFLICT DO NOTHING;", [granularity])
+
+
+# Migration 12
+def drop_state_index(conn, partition=None):
+    """Migration 12: drop demo_geocoded_state_idx, whose state and ZIP
+    filters demo_geocoded_state_zip_prefix_idx serves as well, with DROP
+    INDEX CONCURRENTLY outside of any transaction."""
+    conn.commit()
+    conn.autocommit = True
+    try:
+        conn.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS demo_geocoded_state_idx;")
+    finally:
+        conn.autocommit = False
+
+
+# Migrations in order, as version, name and function
+MIGRATIONS = [(1, "base tables", base_tables),
+              (2, "load manifest and rejects", load_tables),
+              (3, "dashboard indexes", dashboard_indexes),
+              (4, "weekly rollup", weekly_rollup),
+              (5, "quality as-of intervals", quality_asof),
+              (6, "data version", data_version),
+              (7, "week catalog", week_catalog),
+              (8, "ZIP search indexes", zip_search_indexes),
+              (9, "hospital grid", grid),
+              (10, "load rejects key", rejects_key),
+              (11, "weekly partitioning", partitioning),
+              (12, "drop state index", drop_state_index)]
+
+
+def current_version(conn):
+    """Latest migration applied to the database, 0 if none."""
+    conn.execute(create_version)
+    version, = conn.execute(
+        "SELECT coalesce(max(version), 0) FROM schema_version;").fetchone()
+    conn.commit()
+    return version
+
+
+def check_partition(conn, partition):
+    """Fail when weekly already exists and can't be partitioned as
+    asked, since migration 1 only partitions it when it creates it.
+    Parameters
+    ----------
+    conn : psycopg connection
+    partition : str or None
+        Granularity asked for, see migrate
+    """
+    if partition is None:
+        return
+    row = conn.execute("SELECT relkind FROM pg_class "
+                       "WHERE oid = to_regclass('weekly');").fetchone()
+    if row is not None and row[0] != "p":
+        raise ValueError("weekly already exists and isn't partitioned; "
+                         "partitioning it needs --reset and a reload of "
+                         "the data")
+    if row is not None and conn.execute(
+            "SELECT to_regclass('weekly_partitioning');").fetchone()[0]:
+        current = schema.partition_granularity(conn)
+        if current != partition:
+            raise ValueError(f"weekly is already partitioned {current}; "
+                             "changing it needs --reset and a reload of "
+                             "the data")
+
+
+def migrate(conn, partition=None):
+    """Apply the migrations the database doesn't have yet, in order.
+    Parameters
+    ----------
+    conn : psycopg connection
+        Not in autocommit mode; each migration is committed with its
+        schema_version row
+    partition : str, optional
+        "monthly" or "quarterly" to range-partition weekly by
+        collection_week when migration 1 creates it. Partitions are
+        created as weeks are loaded, see schema.ensure_partitions.
+        ValueError when weekly already exists unpartitioned
+
+    Returns
+    -------
+    list of (int, str)
+        Version and name of the migrations applied
+    """
+    # Two runs at the same time apply each migration once
+    conn.execute("SELECT pg_advisory_lock(hashtext('schema migrations'));")
+    try:
+        check_partition(conn, partition)
+        version = current_version(conn)
+        applied = []
+        for number, name, func in MIGRATIONS:
+            if number <= version:
+                continue
+            func(conn, partition)
+            conn.execute("INSERT INTO schema_version (version, name) "
+                         "VALUES (%s, %s);", [number, name])
+            conn.commit()
+            applied.append((number, name))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(
+            "SELECT pg_advisory_unlock(hashtext('schema migrations'));")
+        conn.commit()
+    return applied
+
+
+def reset(conn):
+    """Drop every table, with all its data, and the migration history.
+    Parameters
+    ----------
+    conn : psycopg connection
+    """
+    for table in reversed(schema.TABLES):
+        conn.execute(f"DROP TABLE IF EXISTS {table};")
+    conn.execute("DROP TABLE IF EXISTS schema_version;")
+    conn.commit()
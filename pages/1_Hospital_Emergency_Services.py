@@ -2,11 +2,8 @@
 import os
 import sys
 import inspect
-import json
 import streamlit as st
 import pydeck as pdk
-import psycopg
-import credentials
 
 
 # Set up parent directory for module imports
@@ -15,6 +12,9 @@ currentdir = os.path.dirname(
        inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
+import hospital_grid  # noqa: E402
+import queries  # noqa: E402
+import querylog  # noqa: E402
 
 # Streamlit Configurations
 st.set_page_config(
@@ -22,14 +22,31 @@ st.set_page_config(
    layout="wide",
 )
 
-# Database connection
-conn = psycopg.connect(
-   host="pinniped.postgres.database.azure.com",
-   dbname=credentials.DB_USER,
-   user=credentials.DB_USER,
-   password=credentials.DB_PASSWORD,
-)
-cur = conn.cursor()
+# Queries go to the backend of backends.py, Postgres or a local DuckDB
+# file, and their results are cached until a load changes the data.
+# Open the page with ?debug=1 to time each of them
+log = querylog.page_log("emergency_services")
+
+
+def clear_focus():
+    """Forget the place picked on the map, e.g. when the filters change,
+    and zoom out."""
+    st.session_state.pop("map_focus", None)
+    st.session_state.map_zoom = hospital_grid.MIN_ZOOM
+
+
+def focus_on_selection():
+    """Center the map on the cell or hospital clicked, zooming in to
+    the next grid when it was a cell."""
+    for picked in st.session_state.hospital_map.selection.objects.values():
+        if picked:
+            row = picked[0]
+            st.session_state.map_focus = (row["latitude"], row["longitude"])
+            level = hospital_grid.resolution(st.session_state.map_zoom)
+            if level is not None:
+                st.session_state.map_zoom = hospital_grid.MAX_ZOOM[level] + 1
+            return
+
 
 # Map of Emergency Services
 st.title("Map of Emergency Services by Hospital Location")
@@ -42,154 +59,165 @@ with filter_col:
     st.header("Filters")
 
     # State Filter
-    cur.execute(
-        "SELECT DISTINCT state FROM demo "
-        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL;"
-    )
-    state_options = ["All States"] + [row[0] for row in cur.fetchall()]
+    results, _ = log.fetch("state options", queries.GEOCODED_STATES)
+    state_options = ["All States"] + [row[0] for row in results]
     selected_state = st.selectbox(
-        "Select State", state_options, key="state_filter"
+        "Select State", state_options, key="state_filter",
+        on_change=clear_focus,
     )
 
-    # ZIP Code Filter
-    cur.execute(
-        "SELECT DISTINCT zip FROM demo "
-        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL;"
-    )
-    zip_options = ["All ZIP Codes"] + [row[0] for row in cur.fetchall()]
+    # ZIP Code Filter: only the first ZIP codes of the selected state
+    # starting with what was typed are sent to the browser
+    state = None if selected_state == "All States" else selected_state
+    zip_prefix = st.text_input(
+        "Search ZIP Code", max_chars=10, key="zip_search",
+        placeholder="First digits, e.g. 152",
+    ).strip()
+    results, _ = log.fetch("zip search",
+                           *queries.zip_search(state, zip_prefix))
+    zip_options = ["All ZIP Codes"] + [row[0] for row in results]
     selected_zip = st.selectbox(
-        "Select ZIP Code", zip_options, key="zip_filter"
+        "Select ZIP Code", zip_options, key="zip_filter",
+        on_change=clear_focus,
     )
+    if len(results) == queries.ZIP_SEARCH_LIMIT:
+        st.caption(f"Showing the first {queries.ZIP_SEARCH_LIMIT} "
+                   "matches, type more digits to narrow them down.")
 
     # Emergency Service Filter
     emergency_only = st.checkbox(
         "Show only hospitals with emergency services",
         value=False,
         key="emergency_filter",
+        on_change=clear_focus,
     )
 
-# Build SQL Query Dynamically with Parameters
-filter_conditions = []
-params = []
-
-if selected_state != "All States":
-    filter_conditions.append("state = %s")
-    params.append(selected_state)
-if selected_zip != "All ZIP Codes":
-    filter_conditions.append("zip = %s")
-    params.append(selected_zip)
-if emergency_only:
-    filter_conditions.append("emergency_service = TRUE")
-
-where_clause = " AND ".join(filter_conditions)
-if where_clause:
-    where_clause = (
-        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND " +
-        where_clause
+    # Map Zoom: zoomed out the map shows hospitals grouped in grid cells,
+    # zoomed in the hospitals around the place clicked on the map
+    st.session_state.setdefault("map_zoom", hospital_grid.MIN_ZOOM)
+    zoom = st.select_slider(
+        "Zoom", options=list(range(hospital_grid.MIN_ZOOM, 13)),
+        key="map_zoom"
     )
+    st.button("Zoom out", on_click=clear_focus)
+
+# Map Data: the hospitals of a ZIP code, every cell of the coarsest grid,
+# or what is in view around the place picked on the map, so the map gets
+# about as many circles however many hospitals match
+zip_code = None if selected_zip == "All ZIP Codes" else selected_zip
+resolution = hospital_grid.resolution(zoom)
+center = st.session_state.get("map_focus")
+results = []
+if zip_code is not None:
+    resolution = None
+    results, columns = log.fetch(
+        "hospital map",
+        *queries.hospital_map(state, zip_code, emergency_only))
+elif resolution == 1:
+    results, columns = log.fetch(
+        "hospital cells",
+        *queries.hospital_cells(resolution, None, state, emergency_only))
 else:
-    where_clause = (
-        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
-    )
-
-# SQL Query with All Computation
-query = f"""
-WITH filtered_data AS (
-   SELECT
-       id,
-       name,
-       state,
-       zip,
-       CAST(latitude AS DOUBLE PRECISION) AS latitude,
-       CAST(longitude AS DOUBLE PRECISION) AS longitude,
-       CASE
-           WHEN emergency_service = TRUE THEN 'Yes'
-           ELSE 'No'
-       END AS emergency_service_text,
-       CASE
-           WHEN emergency_service = TRUE THEN '[0, 255, 0]'  -- Green for Yes
-           ELSE '[255, 0, 0]'  -- Red for No
-       END AS color
-   FROM demo
-   {where_clause}
-),
-computed_averages AS (
-   SELECT
-       CAST(AVG(latitude) AS DOUBLE PRECISION) AS latitude_avg,
-       CAST(AVG(longitude) AS DOUBLE PRECISION) AS longitude_avg
-   FROM filtered_data
-)
-SELECT
-   fd.id,
-   fd.name,
-   fd.state,
-   fd.zip,
-   fd.latitude,
-   fd.longitude,
-   fd.emergency_service_text,
-   fd.color,
-   ca.latitude_avg,
-   ca.longitude_avg
-FROM filtered_data fd
-CROSS JOIN computed_averages ca;
-"""
-
-# Execute the SQL Query with parameters
-cur.execute(query, params)
-columns = [desc[0] for desc in cur.description]
-results = cur.fetchall()
+    if center is None:
+        # Nothing picked yet: the middle of the hospitals of the filters
+        finest = max(hospital_grid.CELL_DEGREES)
+        extent, _ = log.fetch(
+            "map extent",
+            *queries.map_extent(finest, state, emergency_only))
+        if extent[0][0] is not None:
+            south, north, west, east = hospital_grid.extent(extent[0],
+                                                            finest)
+            center = ((south + north) / 2, (west + east) / 2)
+    if center is not None:
+        bbox = hospital_grid.viewport(*center, zoom)
+        if resolution is None:
+            results, columns = log.fetch(
+                "hospital map",
+                *queries.hospital_map(state, None, emergency_only, bbox,
+                                      queries.MAP_POINT_LIMIT))
+        else:
+            results, columns = log.fetch(
+                "hospital cells",
+                *queries.hospital_cells(
+                    resolution, hospital_grid.cells(bbox, resolution),
+                    state, emergency_only))
 
 # Visualization Section (in the second column)
 with map_col:
     if results:
-        # Convert results to a list of dictionaries
+        # Rows already hold floats and color channels, as pydeck sends
+        # them to the browser; a DataFrame would be turned back into
+        # these records by pydeck
         data = [dict(zip(columns, row)) for row in results]
-
-        # Ensure all numeric fields are of type float and parse color
-        for row in data:
-            row['latitude'] = float(row['latitude'])
-            row['longitude'] = float(row['longitude'])
-            row['latitude_avg'] = float(row['latitude_avg'])
-            row['longitude_avg'] = float(row['longitude_avg'])
-            row['color'] = json.loads(row['color'])
-
-        # Use SQL-computed averages
-        latitude_avg = data[0]['latitude_avg']
-        longitude_avg = data[0]['longitude_avg']
-
-        # Create PyDeck view
+        if center is None:
+            # The hospitals of a ZIP code, or every cell, weighted by
+            # their hospitals
+            weights = [row.get("hospitals", 1) for row in data]
+            center = tuple(
+                sum(row[axis] * weight for row, weight in zip(data, weights))
+                / sum(weights) for axis in ("latitude", "longitude"))
+
+        # Create PyDeck view, centered on the hospitals shown
         view_state = pdk.ViewState(
-            latitude=latitude_avg,
-            longitude=longitude_avg,
-            zoom=4,
+            latitude=center[0],
+            longitude=center[1],
+            zoom=zoom,
             pitch=0,
         )
 
-        # Create PyDeck layer
-        layer = pdk.Layer(
-            "ScatterplotLayer",
-            data=data,
-            get_position=["longitude", "latitude"],
-            get_color="color",
-            get_radius=10000,
-            pickable=True,
-        )
+        # Create PyDeck layer: circles of a few pixels for hospitals, and
+        # for cells growing with the square root of their hospitals
+        if resolution is None:
+            layer = pdk.Layer(
+                "ScatterplotLayer",
+                id="hospitals",
+                data=data,
+                get_position=["longitude", "latitude"],
+                get_color="[r, g, b]",
+                get_radius=5,
+                radius_units="pixels",
+                pickable=True,
+            )
+            html = ("<b>Hospital:</b> {name}<br>"
+                    "<b>State:</b> {state}<br>"
+                    "<b>ZIP:</b> {zip}<br>"
+                    "<b>Emergency Service:</b> {emergency_service_text}")
+        else:
+            layer = pdk.Layer(
+                "ScatterplotLayer",
+                id="cells",
+                data=data,
+                get_position=["longitude", "latitude"],
+                get_color="[r, g, b]",
+                get_radius="size",
+                radius_units="pixels",
+                radius_scale=4,
+                radius_min_pixels=3,
+                pickable=True,
+            )
+            html = ("<b>Hospitals:</b> {hospitals}<br>"
+                    "<b>With emergency services:</b> {emergency}")
 
         # Configure PyDeck deck with tooltip
         deck = pdk.Deck(
             layers=[layer],
             initial_view_state=view_state,
             tooltip={
-                "html": "<b>Hospital:</b> {name}<br>"
-                        "<b>State:</b> {state}<br>"
-                        "<b>ZIP:</b> {zip}<br>"
-                        "<b>Emergency Service:</b> {emergency_service_text}",
+                "html": html,
                 "style": {"color": "white", "backgroundColor": "black"},
             },
         )
 
-        # Render PyDeck map
-        st.pydeck_chart(deck)
+        # Render PyDeck map; clicking a cell or hospital centers it
+        st.pydeck_chart(deck, on_select=focus_on_selection,
+                        selection_mode="single-object", key="hospital_map")
+        if resolution is not None:
+            st.caption("Hospitals are grouped in cells of "
+                       f"{hospital_grid.CELL_DEGREES[resolution]} degrees, "
+                       "click a cell to zoom in on it.")
+        elif len(results) == queries.MAP_POINT_LIMIT:
+            st.caption(f"Showing {queries.MAP_POINT_LIMIT} hospitals, "
+                       "zoom in or filter to see all of them.")
 
         # # Summary of Hospitals
         # st.subheader("Summary of Hospitals")
@@ -202,3 +230,6 @@ with map_col:
         #     )
     else:
         st.warning("No hospitals found matching the selected criteria.")
+
+# Query breakdown of this render, with ?debug=1
+querylog.show(log)
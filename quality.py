@@ -0,0 +1,285 @@
+"""Cleaning and writing of the hospital quality dataset"""
+import pandas as pd
+from datetime import datetime
+import validate
+from writers import refresh_rows, stage_rows
+
+
+names_dict = {'Facility ID': "hospital_id",
+              'Hospital Type': "type_of_hospital",
+              'Hospital Ownership': "type_of_ownership",
+              'Emergency Services': "emergency_service",
+              'Hospital overall rating': "quality_score"}
+
+# Columns written to the demo table
+DEMO_FIELDS = ["hospital_id", "type_of_hospital", "type_of_ownership",
+               "emergency_service"]
+
+DEMO_CONFLICT = """
+    ON CONFLICT (id)
+    DO UPDATE SET
+        type_of_hospital = EXCLUDED.type_of_hospital,
+        type_of_ownership = EXCLUDED.type_of_ownership,
+        emergency_service = EXCLUDED.emergency_service"""
+
+# Validity intervals of the ratings of some hospitals, each ending where
+# the next rating of the hospital starts
+ASOF_REFRESH = """
+INSERT INTO quality_asof (hospital_id, quality_score, valid_from, valid_to)
+SELECT hospital_id, quality_score, date,
+    COALESCE(LEAD(date) OVER (PARTITION BY hospital_id ORDER BY date),
+             'infinity')
+FROM quality
+WHERE hospital_id = ANY(%s);"""
+
+# Schema applied when reading the file: only the columns the loader uses
+# are parsed. Facility ids stay as text so that leading zeros survive, the
+# few distinct types are stored once as categories, and ratings are read
+# as numbers with "Not Available" as missing
+SCHEMA = {'Facility ID': str,
+          'Hospital Type': 'category',
+          'Hospital Ownership': 'category',
+          'Emergency Services': 'category',
+          'Hospital overall rating': 'float64'}
+NA_VALUES = ['', 'NA', 'N/A', 'NaN', 'nan', 'NULL', 'Not Available']
+READ_OPTIONS = {"usecols": list(SCHEMA),
+                "dtype": SCHEMA,
+                "na_values": NA_VALUES,
+                "keep_default_na": False}
+
+
+def read(filepath):
+    """Read a hospital quality dataset CSV.
+    Parameters
+    ----------
+    filepath : str
+        Path to the CSV file
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    return pd.read_csv(filepath, **READ_OPTIONS)
+
+
+def clean(df, date):
+    """Clean raw quality rows into the demo and quality tables.
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Raw rows of the quality dataset
+    date : str
+        Date of the data, formatted as YYYY-MM-DD
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame, pd.DataFrame)
+        Rows for the demo table and rows for the quality table, and rows
+        breaking a table constraint (see validate.split)
+    """
+    df = df.rename(columns=names_dict)
+
+    # Cleaning data for Unique hospital id
+    df = df[df['hospital_id'].str.match(r'^\d{6}$', na=False)]
+    df = df.dropna(subset=['hospital_id'])
+    df = df.drop_duplicates(subset=['hospital_id'])
+
+    # Cleaning data to add to quality table, "Not Available" is read as NaN
+    df_quality = df[["hospital_id", "quality_score"]].dropna()
+    df_quality["quality_score"] = df_quality["quality_score"].astype(int)
+
+    date = datetime.strptime(date, "%Y-%m-%d").date()
+    df_quality["date"] = date
+    # Convert float("NaN") type to python None type
+    df = df[DEMO_FIELDS]
+    df = df.astype(object).where(df.notna(), None)
+
+    # Emergency service values that aren't booleans are dropped, rows
+    # that would still break a table constraint are set aside
+    df = validate.clear(df, validate.QUALITY_DEMO_CLEARED)
+    df, demo_rejects = validate.split(df, "demo", validate.QUALITY_DEMO_RULES)
+    quality_rules = validate.QUALITY_RULES + [
+        ("quality_hospital_id_fkey",
+         validate.references("hospital_id", df["hospital_id"]))]
+    df_quality, quality_rejects = validate.split(df_quality, "quality",
+                                                 quality_rules)
+    return df, df_quality, pd.concat([demo_rejects, quality_rejects],
+                                     ignore_index=True)
+
+
+def drop_loaded(conn, df, df_quality):
+    """Drop hospitals whose quality score for this date is already in the
+    database.
+    Parameters
+    ----------
+    conn : psycopg connection
+    df : pd.DataFrame
+        Rows for the demo table
+    df_quality : pd.DataFrame
+        Rows for the quality table
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame)
+        Rows for the demo and quality tables of the remaining hospitals
+    """
+    loaded = conn.execute(
+        "SELECT hospital_id FROM quality WHERE date = ANY(%s);",
+        [sorted(df_quality['date'].unique())]).fetchall()
+    conn.commit()
+    if loaded:
+        loaded = [row[0] for row in loaded]
+        df = df[~df['hospital_id'].isin(loaded)]
+        df_quality = df_quality[~df_quality['hospital_id'].isin(loaded)]
+    return df, df_quality
+
+
+def refresh_asof(conn, hospital_ids):
+    """Recompute the quality_asof intervals of some hospitals from the
+    quality table.
+    Parameters
+    ----------
+    conn : psycopg connection
+    hospital_ids : iterable of str
+        Hospitals whose quality rows changed
+    """
+    hospital_ids = sorted(set(hospital_ids))
+    if not hospital_ids:
+        return
+    refresh_rows(conn, "quality_asof", ASOF_REFRESH, [hospital_ids],
+                 "hospital_id", hospital_ids)
+
+
+def write(conn, df, df_quality):
+    """Write cleaned rows into the demo table, then the quality table.
+    Parameters
+    ----------
+    conn : psycopg connection
+    df : pd.DataFrame
+        Rows for the demo table
+    df_quality : pd.DataFrame
+        Rows for the quality table
+
+    Returns
+    -------
+    (int, int)
+        Number of rows written into demo and into quality, None for a
+        table whose write failed and was rolled back
+    """
+    demo_count = quality_count = 0
+
+    # Convert float("NaN") type to python None type; rows replayed from
+    # the cache come back from Parquet with NaN for missing values
+    df = df.astype(object).where(df.notna(), None)
+    list_quality = [(row.hospital_id, row.date,  row.quality_score) for row in
+                    df_quality.itertuples(index=False)]
+
+    cur = conn.cursor()
+
+    # Writing into "demo" database
+    try:
+
+        cur.executemany("""
+           INSERT INTO demo (id, type_of_hospital, type_of_ownership, \
+                        emergency_service)
+           VALUES (%s, %s, %s, %s)
+           """ + DEMO_CONFLICT + ";", [
+               (row.hospital_id, row.type_of_hospital, row.type_of_ownership,
+                row.emergency_service)
+               for row in df.itertuples(index=False)
+           ])
+        demo_count = cur.rowcount
+
+    except Exception as err:
+        # Stop transaction in case of error, prints current rowcount
+        print(err, " at row ", cur.rowcount)
+        conn.rollback()
+        demo_count = None
+    else:
+        conn.commit()
+
+    # Writing into the "quality" database
+    try:
+        cur.executemany("""INSERT INTO quality (hospital_id, date, quality_score)
+                        VALUES (%s, %s, cast(%s as integer))
+                        ON CONFLICT (hospital_id, date) DO NOTHING;""",
+                        list_quality)
+        quality_count = cur.rowcount
+
+    except Exception as err:
+        # Stops transaction in case of error, prints current rowcount
+        rowcount = cur.rowcount
+        print(err, " at row ", rowcount)
+        conn.rollback()
+        quality_count = None
+    else:
+        conn.commit()
+
+    return demo_count, quality_count
+
+
+def copy_write(conn, df, df_quality):
+    """Write cleaned rows into the demo and quality tables in a single
+    transaction, through one COPY into a staging table and two set-based
+    statements.
+    Parameters
+    ----------
+    conn : psycopg connection
+    df : pd.DataFrame
+        Rows for the demo table
+    df_quality : pd.DataFrame
+        Rows for the quality table
+
+    Returns
+    -------
+    (int, int)
+        Number of rows written into demo and into quality, None for both
+        if the transaction failed and was rolled back
+    """
+    # One staging row per hospital, with its score and date when it has one
+    staged = df[DEMO_FIELDS].merge(
+        df_quality[["hospital_id", "quality_score", "date"]],
+        how="left", on="hospital_id")
+    staged["quality_score"] = staged["quality_score"].astype(
+        "Int64").astype(object)
+    staged = staged.astype(object).where(staged.notna(), None)
+
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            CREATE TEMP TABLE quality_staging (
+                hospital_id TEXT,
+                type_of_hospital TEXT,
+                type_of_ownership TEXT,
+                emergency_service BOOLEAN,
+                quality_score INTEGER,
+                date DATE
+            ) ON COMMIT DROP;""")
+        stage_rows(cur, "quality_staging", list(staged.columns),
+                   staged.itertuples(index=False, name=None))
+
+        cur.execute("""
+            INSERT INTO demo (id, type_of_hospital, type_of_ownership,
+                              emergency_service)
+            SELECT hospital_id, type_of_hospital, type_of_ownership,
+                   emergency_service
+            FROM quality_staging
+            """ + DEMO_CONFLICT + ";")
+        demo_count = cur.rowcount
+
+        cur.execute("""
+            INSERT INTO quality (hospital_id, date, quality_score)
+            SELECT hospital_id, date, quality_score
+            FROM quality_staging
+            WHERE quality_score IS NOT NULL
+            ON CONFLICT (hospital_id, date) DO NOTHING;""")
+        quality_count = cur.rowcount
+
+    except Exception as err:
+        # Neither table is changed when either statement fails
+        print(err)
+        conn.rollback()
+        return None, None
+
+    conn.commit()
+    return demo_count, quality_count
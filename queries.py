@@ -0,0 +1,274 @@
+"""SQL run by the dashboard, shared with create_indexes.py so the index
+report explains exactly the queries the pages send"""
+
+# Version of the data, bumped by the loaders, that cached results are
+# kept for
+DATA_VERSION = "SELECT version FROM data_version;"
+
+# Weeks offered in the week selector, with their row counts and last load,
+# from the catalog the HHS loaders keep
+WEEK_OPTIONS = """
+SELECT collection_week, row_count, last_loaded_at
+FROM week_catalog
+ORDER BY collection_week;"""
+
+# Plots 1, 2 and 4: the per-week sums kept in weekly_rollup by the HHS
+# loaders, one row per week. All weeks are read at once, whatever the
+# selected week, and each panel slices what it shows, so the result is
+# cached once for every week of the dropdown
+WEEKLY_METRICS = """
+SELECT collection_week, hospital_records, adult_beds, pediatric_beds,
+    adult_bed_occupied+pediatric_bed_occupied AS beds_used,
+    beds_covid+icu_covid AS beds_covid,
+    adult_beds_paired AS total_beds,
+    beds_covid_paired AS covid_beds
+FROM weekly_rollup
+ORDER BY collection_week;"""
+
+# Plots 3 and 5 take the rating of each hospital as of the selected week
+# from quality_asof: the latest rating dated on or before the week, i.e.
+# the interval with valid_from <= week < valid_to
+
+# Plot 3: fraction of adult beds occupied by latest quality rating
+BED_FRACTION_BY_QUALITY = """
+SELECT quality_asof.quality_score,
+    sum(weekly.adult_bed_occupied)/sum(weekly.adult_beds) as bed_fraction
+FROM weekly INNER JOIN quality_asof ON
+    weekly.hospital_id = quality_asof.hospital_id
+WHERE weekly.collection_week = %s
+    AND weekly.adult_bed_occupied is NOT NULL
+    AND weekly.adult_beds is NOT NULL
+    AND quality_asof.valid_from <= %s
+    AND quality_asof.valid_to > %s
+GROUP BY quality_asof.quality_score;"""
+
+# Plot 5: COVID and COVID ICU beds per week by latest quality rating
+COVID_BY_QUALITY = """
+SELECT
+    A.collection_week,
+    LQ.quality_score,
+    SUM(A.beds_covid) AS beds_covid,
+    SUM(A.icu_covid) AS icu_covid,
+    SUM(A.icu_covid)/SUM(A.beds_covid) AS icu_fraction
+FROM weekly A
+JOIN quality_asof LQ
+ON A.hospital_id = LQ.hospital_id
+    AND LQ.valid_from <= %s AND LQ.valid_to > %s
+WHERE A.collection_week <= %s
+GROUP BY LQ.quality_score, A.collection_week
+ORDER BY A.collection_week, LQ.quality_score;"""
+
+# Plot 6: COVID beds by state in the selected week
+COVID_BEDS_BY_STATE = """
+SELECT demo.state, sum(weekly.beds_covid) as covid_beds
+FROM weekly INNER JOIN demo ON weekly.hospital_id = demo.id
+WHERE weekly.collection_week = %s
+GROUP BY demo.state"""
+
+# Emergency services page: filter options, geocoded hospitals only
+GEOCODED_STATES = ("SELECT DISTINCT state FROM demo "
+                   "WHERE latitude IS NOT NULL AND longitude IS NOT NULL;")
+
+# Emergency services page: ZIP codes starting with what the user typed,
+# in the selected state or any, at most ZIP_SEARCH_LIMIT of them. The
+# LIKE prefix is matched on the text_pattern_ops indexes of schema.py,
+# with the default backslash escape of PostgreSQL: an ESCAPE clause would
+# turn it into like_escape(), which the planner can't match on them.
+# DuckDB takes the backslash literally instead, and as no ZIP code holds
+# a backslash or a wildcard, an escaped prefix matches none on either
+ZIP_SEARCH = """
+SELECT DISTINCT zip
+FROM demo
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    AND zip LIKE %s{state_condition}
+ORDER BY zip
+LIMIT %s;"""
+ZIP_SEARCH_LIMIT = 50
+
+# Emergency services page: geocoded hospitals, one row each with typed
+# columns only. Positions are rounded to about a meter, all the map
+# shows, and colors come as numeric channels, green for hospitals with
+# emergency services and red for the others. Zoomed in, the page only
+# fetches the hospitals in view, at most MAP_POINT_LIMIT of them
+HOSPITAL_MAP = """
+SELECT
+    name,
+    state,
+    zip,
+    CAST(round(latitude, 5) AS DOUBLE PRECISION) AS latitude,
+    CAST(round(longitude, 5) AS DOUBLE PRECISION) AS longitude,
+    CASE WHEN emergency_service THEN 'Yes' ELSE 'No' END
+        AS emergency_service_text,
+    CASE WHEN emergency_service THEN 0 ELSE 255 END AS r,
+    CASE WHEN emergency_service THEN 255 ELSE 0 END AS g,
+    0 AS b
+FROM demo
+{where_clause}{limit_clause};"""
+MAP_POINT_LIMIT = 2000
+
+# Emergency services page zoomed out: the cells of hospital_grid, all of
+# them on the coarsest grid and those in view on the finer ones, at their
+# mean position, sized by their number of hospitals and colored
+# from red to green by the share with emergency services
+HOSPITAL_CELLS = """
+SELECT
+    CAST(sum(latitude_sum) / sum(hospitals) AS DOUBLE PRECISION)
+        AS latitude,
+    CAST(sum(longitude_sum) / sum(hospitals) AS DOUBLE PRECISION)
+        AS longitude,
+    CAST(sum(hospitals) AS INTEGER) AS hospitals,
+    CAST(sum(CASE WHEN emergency_service THEN hospitals ELSE 0 END)
+        AS INTEGER) AS emergency,
+    sqrt(CAST(sum(hospitals) AS DOUBLE PRECISION)) AS size,
+    CAST(round(255.0 * sum(CASE WHEN emergency_service THEN 0
+                               ELSE hospitals END) / sum(hospitals))
+        AS INTEGER) AS r,
+    CAST(round(255.0 * sum(CASE WHEN emergency_service THEN hospitals
+                               ELSE 0 END) / sum(hospitals))
+        AS INTEGER) AS g,
+    0 AS b
+FROM hospital_grid
+WHERE resolution = %s{conditions}
+GROUP BY cell_lat, cell_lon;"""
+
+# Emergency services page: range of the cells holding the hospitals
+# shown, where the zoomed in map is centered unless the user picked a
+# place on it
+MAP_EXTENT = """
+SELECT min(cell_lat) AS lat_first, max(cell_lat) AS lat_last,
+    min(cell_lon) AS lon_first, max(cell_lon) AS lon_last
+FROM hospital_grid
+WHERE resolution = %s{conditions};"""
+
+
+def hospital_map(state=None, zip_code=None, emergency_only=False,
+                 bbox=None, limit=None):
+    """Map query of the emergency services page for a set of filters.
+    Parameters
+    ----------
+    state : str, optional
+        Only hospitals in this state
+    zip_code : str, optional
+        Only hospitals with this ZIP code
+    emergency_only : bool
+        Only hospitals with emergency services
+    bbox : (float, float, float, float), optional
+        Only hospitals within these south, north, west and east edges
+    limit : int, optional
+        Number of hospitals returned at most
+
+    Returns
+    -------
+    (str, list)
+        Query and its parameters
+    """
+    filter_conditions = ["latitude IS NOT NULL", "longitude IS NOT NULL"]
+    params = []
+    if state is not None:
+        filter_conditions.append("state = %s")
+        params.append(state)
+    if zip_code is not None:
+        filter_conditions.append("zip = %s")
+        params.append(zip_code)
+    if emergency_only:
+        filter_conditions.append("emergency_service = TRUE")
+    if bbox is not None:
+        # Compared as decimals, like the columns, to use their index
+        filter_conditions += [
+            "latitude BETWEEN CAST(%s AS DECIMAL(9, 6)) "
+            "AND CAST(%s AS DECIMAL(9, 6))",
+            "longitude BETWEEN CAST(%s AS DECIMAL(9, 6)) "
+            "AND CAST(%s AS DECIMAL(9, 6))"]
+        params += [round(edge, 6) for edge in bbox]
+    where_clause = "WHERE " + " AND ".join(filter_conditions)
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = "\nLIMIT %s"
+        params.append(limit)
+    return (HOSPITAL_MAP.format(where_clause=where_clause,
+                                limit_clause=limit_clause), params)
+
+
+def grid_conditions(state=None, emergency_only=False):
+    """Conditions on hospital_grid for the filters of the emergency
+    services page.
+    Parameters
+    ----------
+    state : str, optional
+    emergency_only : bool
+
+    Returns
+    -------
+    (str, list)
+        Conditions, each starting with AND, and their parameters
+    """
+    conditions = ""
+    params = []
+    if state is not None:
+        conditions += "\n    AND state = %s"
+        params.append(state)
+    if emergency_only:
+        conditions += "\n    AND emergency_service"
+    return conditions, params
+
+
+def hospital_cells(resolution, cells=None, state=None,
+                   emergency_only=False):
+    """Grid query of the emergency services page zoomed out.
+    Parameters
+    ----------
+    resolution : int
+        Grid resolution, see hospital_grid.py
+    cells : (int, int, int, int), optional
+        First and last cell_lat, first and last cell_lon in view; all
+        cells by default
+    state : str, optional
+        Only hospitals in this state
+    emergency_only : bool
+        Only hospitals with emergency services
+
+    Returns
+    -------
+    (str, list)
+        Query and its parameters
+    """
+    conditions, params = grid_conditions(state, emergency_only)
+    if cells is not None:
+        conditions = ("\n    AND cell_lat BETWEEN %s AND %s"
+                      "\n    AND cell_lon BETWEEN %s AND %s" + conditions)
+        params = [*cells] + params
+    return (HOSPITAL_CELLS.format(conditions=conditions),
+            [resolution] + params)
+
+
+def map_extent(resolution, state=None, emergency_only=False):
+    """Query of the cells holding the hospitals of the emergency services
+    map, see hospital_cells."""
+    conditions, params = grid_conditions(state, emergency_only)
+    return (MAP_EXTENT.format(conditions=conditions),
+            [resolution] + params)
+
+
+def zip_search(state=None, prefix="", limit=ZIP_SEARCH_LIMIT):
+    """ZIP code search of the emergency services page.
+    Parameters
+    ----------
+    state : str, optional
+        Only ZIP codes of hospitals in this state
+    prefix : str
+        Start of the ZIP code, as typed; LIKE wildcards in it are matched
+        literally
+    limit : int
+        Number of ZIP codes returned at most
+
+    Returns
+    -------
+    (str, list)
+        Query and its parameters
+    """
+    pattern = (prefix.replace("\\", "\\\\").replace("%", "\\%")
+               .replace("_", "\\_") + "%")
+    if state is None:
+        return ZIP_SEARCH.format(state_condition=""), [pattern, limit]
+    return (ZIP_SEARCH.format(state_condition="\n    AND state = %s"),
+            [pattern, state, limit])
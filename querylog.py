@@ -0,0 +1,164 @@
+"""Timing of the queries sent while a dashboard page renders
+
+Pages send their queries through QueryLog.fetch with a name for each.
+With ?debug=1 in the page URL the log records the wall time, rows and
+bytes fetched of every query, can capture EXPLAIN (ANALYZE, BUFFERS)
+plans, and shows the breakdown of the render in the sidebar with a JSON
+download. Without it nothing is recorded. Queries go to the backend
+chosen in backends.py, through the result cache of result_cache.py, at
+the data version read once per render.
+"""
+import json
+import time
+from datetime import datetime
+import backends
+import queries
+import result_cache
+
+
+class QueryLog:
+    """Queries of one page render.
+    Parameters
+    ----------
+    page : str
+        Name of the page, kept in the JSON export
+    enabled : bool
+        Record each query
+    explain : bool
+        Also capture the EXPLAIN ANALYZE plan of each query, which runs
+        it a second time. Queries then skip the result cache
+    """
+
+    def __init__(self, page, enabled=False, explain=False):
+        self.page = page
+        self.enabled = enabled
+        self.explain = enabled and explain
+        self.started = datetime.now()
+        self.entries = []
+        self.version = None
+
+    def data_version(self):
+        """Version of the data this render reads, see result_cache.py."""
+        if self.version is None:
+            rows, _ = backends.current().fetch(queries.DATA_VERSION)
+            self.version = rows[0][0]
+            result_cache.cache().set_version(self.version)
+        return self.version
+
+    def fetch(self, name, query, params=None):
+        """Run a query on the backend of the page, recording it when
+        enabled.
+        Parameters
+        ----------
+        name : str
+            Name of the query in the breakdown, e.g. "plot 3"
+        query : str
+        params : list, optional
+
+        Returns
+        -------
+        (list of tuple, list of str)
+            Result rows and column names
+        """
+        backend = backends.current()
+        cache = result_cache.cache()
+        version = self.data_version()
+        key = (query, tuple(params or ()))
+        if not self.explain:
+            start = time.perf_counter()
+            result = cache.get(version, key)
+            if result is not None:
+                if self.enabled:
+                    self.record(name, params, result[0], {
+                        "ms": (time.perf_counter() - start) * 1000,
+                        "bytes": 0, "plan": None}, cached=True)
+                return result
+        if self.enabled:
+            rows, columns, stats = backend.profile(query, params,
+                                                   self.explain)
+            self.record(name, params, rows, stats, cached=False)
+        else:
+            rows, columns = backend.fetch(query, params)
+        cache.put(version, key, rows, columns)
+        return rows, columns
+
+    def record(self, name, params, rows, stats, cached):
+        """Add a query to the breakdown."""
+        self.entries.append({"name": name,
+                             "ms": round(stats["ms"], 2),
+                             "rows": len(rows),
+                             "bytes": stats["bytes"],
+                             "cached": cached,
+                             "params": [str(param) for param in params or []],
+                             "plan": stats["plan"]})
+
+    def total_ms(self):
+        """Wall time of all recorded queries, in ms."""
+        return sum(entry["ms"] for entry in self.entries)
+
+    def to_json(self):
+        """The breakdown as a JSON document."""
+        return json.dumps({"page": self.page,
+                           "backend": backends.current().name,
+                           "rendered_at": self.started.isoformat(
+                               timespec="seconds"),
+                           "total_ms": round(self.total_ms(), 2),
+                           "data_version": self.version,
+                           "cache": result_cache.cache().stats(),
+                           "queries": self.entries}, indent=2)
+
+
+def page_log(page):
+    """QueryLog of the current render of a Streamlit page, enabled by
+    ?debug=1 in the URL, which also adds an EXPLAIN switch to the
+    sidebar.
+    Parameters
+    ----------
+    page : str
+
+    Returns
+    -------
+    QueryLog
+    """
+    import streamlit as st
+
+    if st.query_params.get("debug") != "1":
+        return QueryLog(page)
+    explain = st.sidebar.checkbox("Capture EXPLAIN ANALYZE",
+                                  value=False, key="debug_explain")
+    return QueryLog(page, enabled=True, explain=explain)
+
+
+def show(log):
+    """Show the query breakdown of a render in the sidebar, with a JSON
+    download. Does nothing when the log is disabled.
+    Parameters
+    ----------
+    log : QueryLog
+    """
+    if not log.enabled:
+        return
+    import pandas as pd
+    import streamlit as st
+
+    sidebar = st.sidebar
+    sidebar.header("Query timings")
+    sidebar.write(f"{len(log.entries)} queries, {log.total_ms():.1f} ms")
+    # Results served from the cache took no query and fetched no bytes
+    table = pd.DataFrame(log.entries, columns=["name", "ms", "rows",
+                                               "bytes", "cached"])
+    sidebar.dataframe(table.sort_values("ms", ascending=False),
+                      hide_index=True)
+    stats = result_cache.cache().stats()
+    sidebar.caption(f"Data version {log.version}; result cache: "
+                    f"{stats['entries']} results, "
+                    f"{stats['bytes'] / 2 ** 20:.1f} MB, "
+                    f"{stats['hits']} hits, {stats['misses']} misses")
+    for entry in log.entries:
+        if entry["plan"] is not None:
+            with sidebar.expander(entry["name"]):
+                st.code(entry["plan"])
+    sidebar.download_button(
+        "Download as JSON", log.to_json(),
+        file_name=f"{log.page}-{log.started:%Y%m%d-%H%M%S}.json",
+        mime="application/json")
@@ -0,0 +1,19 @@
+"""Recompute the rating intervals of every hospital in the quality table.
+The quality_asof table is created by create_tables.py"""
+import db
+import manifest
+import quality
+
+
+conn = db.connect()
+
+hospitals = [hospital for hospital, in conn.execute(
+    "SELECT DISTINCT hospital_id FROM quality;").fetchall()]
+# Hospitals no longer in quality are dropped as well
+hospitals += [hospital for hospital, in conn.execute(
+    "SELECT DISTINCT hospital_id FROM quality_asof;").fetchall()]
+quality.refresh_asof(conn, hospitals)
+manifest.bump_data_version(conn)
+print(len(set(hospitals)), " hospitals in quality_asof have been refreshed")
+
+conn.close()
@@ -0,0 +1,15 @@
+"""Recompute the hospital_grid table from the demo table. The table is
+created by create_tables.py"""
+import db
+import hospital_grid
+import manifest
+
+
+conn = db.connect()
+
+hospital_grid.refresh(conn)
+manifest.bump_data_version(conn)
+cells, = conn.execute("SELECT count(*) FROM hospital_grid;").fetchone()
+print(cells, " cells in hospital_grid have been refreshed")
+
+conn.close()
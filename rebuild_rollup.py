@@ -0,0 +1,20 @@
+"""Recompute the weekly_rollup and week_catalog tables for every week in
+the weekly table. The tables are created by create_tables.py"""
+import db
+import manifest
+import hhs
+
+
+conn = db.connect()
+
+weeks = [week for week, in conn.execute(
+    "SELECT DISTINCT collection_week FROM weekly;").fetchall()]
+# Weeks no longer in weekly are dropped as well
+weeks += [week for week, in conn.execute(
+    "SELECT collection_week FROM weekly_rollup "
+    "UNION SELECT collection_week FROM week_catalog;").fetchall()]
+hhs.refresh_rollup(conn, weeks)
+manifest.bump_data_version(conn)
+print(len(set(weeks)), " weeks in weekly_rollup have been refreshed")
+
+conn.close()
@@ -0,0 +1,89 @@
+"""Rebuild the database from the columnar cache of cleaned loader output,
+without parsing any CSV"""
+import argparse
+from datetime import datetime
+import db
+import hhs
+import hospital_grid
+import loader_cache
+import manifest
+import quality
+import validate
+from writers import copy_rows, insert_rows
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("cache_dir", help="cache directory written by the "
+                                      "loaders' --cache option")
+parser.add_argument("--copy", action="store_true",
+                    help="bulk load through COPY and staging tables")
+parser.add_argument("--force", action="store_true",
+                    help="replay entries even if the load manifest says "
+                         "their files were already loaded")
+args = parser.parse_args()
+
+conn = db.connect()
+# Whether demo rows were written, so the map grid must be recomputed
+grid_stale = False
+
+# HHS entries go first so quality rows only add to known hospitals
+for path, meta in loader_cache.entries(args.cache_dir):
+    dataset = meta["dataset"]
+    date = None
+    if meta["date"] is not None:
+        date = datetime.strptime(meta["date"], "%Y-%m-%d").date()
+    if not args.force and manifest.find_load(
+            conn, dataset, meta["checksum"], date) is not None:
+        print(f"{meta['file_name']} was already loaded, skipping")
+        continue
+
+    demo_total = data_total = 0
+    failed = False
+    if dataset == "hhs":
+        write_rows = copy_rows if args.copy else insert_rows
+        for df1, df2, rejects in loader_cache.read_parts(
+                path, ["weekly", "demo", "rejects"]):
+            validate.record_rejects(conn, dataset, meta["file_name"], rejects)
+            if not args.force:
+                df1, df2 = hhs.drop_loaded(conn, df1, df2)
+            demo_count, data_count = hhs.write(conn, df1, df2, write_rows)
+            failed = failed or demo_count is None or data_count is None
+            demo_total += demo_count or 0
+            data_total += data_count or 0
+        weeks = [datetime.strptime(week, "%Y-%m-%d").date()
+                 for week in meta["weeks"]]
+        hhs.refresh_rollup(conn, weeks)
+    else:
+        write = quality.copy_write if args.copy else quality.write
+        hospitals = set()
+        for df, df_quality, rejects in loader_cache.read_parts(
+                path, ["demo", "quality", "rejects"]):
+            validate.record_rejects(conn, dataset, meta["file_name"], rejects)
+            hospitals.update(df_quality['hospital_id'])
+            if not args.force:
+                df, df_quality = quality.drop_loaded(conn, df, df_quality)
+            demo_count, data_count = write(conn, df, df_quality)
+            failed = failed or demo_count is None or data_count is None
+            demo_total += demo_count or 0
+            data_total += data_count or 0
+        quality.refresh_asof(conn, hospitals)
+        weeks = [date]
+
+    grid_stale = grid_stale or demo_total > 0
+    if demo_total or data_total:
+        manifest.bump_data_version(conn)
+    table = "weekly" if dataset == "hhs" else "quality"
+    print(f"{meta['file_name']}: {demo_total} rows into demo, "
+          f"{data_total} rows into {table}")
+    if not failed:
+        manifest.record_load(conn, dataset, meta["file_name"],
+                             meta["checksum"], meta["rows_read"], demo_total,
+                             data_total, weeks, file_size=meta["file_size"])
+
+# The map grid is recomputed once, after every entry is replayed, and the
+# dashboard then drops the maps it cached from the old grid
+if grid_stale:
+    hospital_grid.refresh(conn)
+    manifest.bump_data_version(conn)
+
+conn.close()
@@ -0,0 +1,112 @@
+"""Results of dashboard queries kept in memory across reruns and sessions
+
+Results are keyed by query and parameters, and belong to the version of
+the data_version table they were read at. The loaders bump that version
+once a load has changed the data; the first render to see a new version
+drops every older result, so a result stays valid until a load actually
+changes the data. The least recently used results are evicted once
+their estimated size passes RESULT_CACHE_MB (256 by default).
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+_cache = None
+# Held while the cache is created, see db.pool
+_cache_lock = threading.Lock()
+
+
+def result_size(rows, columns):
+    """Estimated memory held by a result, in bytes."""
+    size = sys.getsizeof(rows) + sys.getsizeof(columns)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value)
+                                         for value in row)
+    return size
+
+
+class ResultCache:
+    """Least recently used query results of one data version.
+    Parameters
+    ----------
+    max_bytes : int
+        Estimated size above which the oldest results are evicted
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.size = 0
+        self.hits = self.misses = 0
+        self.results = OrderedDict()
+        # Panels of a page read and fill the cache from several threads
+        self.lock = threading.Lock()
+
+    def set_version(self, version):
+        """Move to a data version, dropping results of any other."""
+        with self.lock:
+            if version != self.version:
+                self.results.clear()
+                self.size = 0
+                self.version = version
+
+    def get(self, version, key):
+        """Result cached for a key at a data version.
+        Parameters
+        ----------
+        version : int
+        key : tuple
+            Query and parameters
+
+        Returns
+        -------
+        (list of tuple, list of str) or None
+            Rows and column names, None if not cached
+        """
+        with self.lock:
+            if version != self.version or key not in self.results:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            rows, columns, _ = self.results[key]
+        return list(rows), list(columns)
+
+    def put(self, version, key, rows, columns):
+        """Cache the result of a key read at a data version. Results of
+        an older version, or too large to cache, are not kept."""
+        size = result_size(rows, columns)
+        with self.lock:
+            if version != self.version or size > self.max_bytes:
+                return
+            if key in self.results:
+                self.size -= self.results.pop(key)[2]
+            self.results[key] = (list(rows), list(columns), size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.results.popitem(last=False)
+                self.size -= evicted
+
+    def stats(self):
+        """Entries, estimated size, hits and misses, for the debug
+        sidebar."""
+        with self.lock:
+            return {"version": self.version, "entries": len(self.results),
+                    "bytes": self.size, "hits": self.hits,
+                    "misses": self.misses}
+
+
+def cache():
+    """Result cache shared by everything in this process, created on
+    first use.
+    Returns
+    -------
+    ResultCache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                int(float(os.environ.get("RESULT_CACHE_MB", 256)) * 2 ** 20))
+    return _cache
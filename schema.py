@@ -0,0 +1,174 @@
+"""Tables and indexes of the database, and the partitions of weekly
+
+The tables are created by the migrations in migrations.py, which hold
+their definitions. INDEXES lists the dashboard indexes as the queries
+need them now; create_indexes.py builds the missing ones.
+"""
+from datetime import date
+
+# Months per partition of a partitioned weekly table
+PARTITION_MONTHS = {"monthly": 1, "quarterly": 3}
+
+# Tables in creation order, referenced tables first
+TABLES = ["demo", "quality", "quality_asof", "weekly", "weekly_rollup",
+          "week_catalog", "hospital_grid", "load_manifest", "load_rejects",
+          "data_version", "weekly_partitioning"]
+
+# Indexes designed from the dashboard queries in queries.py, as name and
+# definition. The emergency services page only shows geocoded hospitals,
+# so its indexes are partial on that condition
+INDEXES = [
+    # Week selector, per-week filters and the <= week ranges of the plots
+    ("weekly_collection_week_idx", "ON weekly (collection_week)"),
+    # Latest quality rating of a hospital, without visiting the table
+    ("quality_hospital_date_idx",
+     "ON quality (hospital_id, date DESC) INCLUDE (quality_score)"),
+    # Ratings valid on a date: only intervals ending after it are read
+    ("quality_asof_valid_to_idx",
+     "ON quality_asof (valid_to) "
+     "INCLUDE (valid_from, hospital_id, quality_score)"),
+    # ZIP filter alone and the ZIP options
+    ("demo_geocoded_zip_idx",
+     "ON demo (zip) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    # State filter, state and ZIP filter, the state options, and the ZIP
+    # search: prefixes of the ZIP codes of one state, or of any,
+    # whatever the collation of the database
+    ("demo_geocoded_state_zip_prefix_idx",
+     "ON demo (state, zip text_pattern_ops) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    ("demo_geocoded_zip_prefix_idx",
+     "ON demo (zip text_pattern_ops) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    # Hospitals in the bounding box of a zoomed in map
+    ("demo_geocoded_position_idx",
+     "ON demo (latitude, longitude) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"),
+    # Hospitals with emergency services, in any or one state
+    ("demo_geocoded_emergency_idx",
+     "ON demo (state) "
+     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL "
+     "AND emergency_service"),
+]
+
+
+def build_indexes(conn, indexes):
+    """Build the indexes that don't exist yet, with CREATE INDEX
+    CONCURRENTLY so loads and the dashboard keep running.
+    Parameters
+    ----------
+    conn : psycopg connection
+        In autocommit mode, which CREATE INDEX CONCURRENTLY needs
+    indexes : list of (str, str)
+        Names and definitions of the indexes, as in INDEXES
+
+    Returns
+    -------
+    list of str
+        Names of the indexes built
+    """
+    built = []
+    tables = set()
+    for index, definition in indexes:
+        table = definition.split()[1]
+        tables.add(table)
+        # An interrupted concurrent build leaves an invalid index behind
+        row = conn.execute(
+            "SELECT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = %s;", [index]).fetchone()
+        if row is not None and row[0]:
+            continue
+        if row is not None:
+            conn.execute(f"DROP INDEX CONCURRENTLY {index};")
+        kind, = conn.execute(
+            "SELECT relkind FROM pg_class WHERE oid = %s::regclass;",
+            [table]).fetchone()
+        if kind == "p":
+            # Partitioned tables can't build concurrently; each partition
+            # is locked against writes while its part is built
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index} {definition};")
+        else:
+            conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} "
+                         f"{definition};")
+        built.append(index)
+    # Fresh statistics for the planner, and a visibility map so that
+    # covering indexes can answer without visiting the table
+    if tables:
+        conn.execute(f"VACUUM ANALYZE {', '.join(sorted(tables))};")
+    return built
+
+
+def partition_granularity(conn):
+    """Granularity of the weekly partitions.
+    Parameters
+    ----------
+    conn : psycopg connection
+
+    Returns
+    -------
+    str or None
+        "monthly" or "quarterly", None if weekly isn't partitioned
+    """
+    row = conn.execute(
+        "SELECT granularity FROM weekly_partitioning;").fetchone()
+    return None if row is None else row[0]
+
+
+def partition_bounds(week, granularity):
+    """First day of the partition holding a week, and of the next one.
+    Parameters
+    ----------
+    week : datetime.date or pd.Timestamp
+    granularity : str
+        "monthly" or "quarterly"
+
+    Returns
+    -------
+    (datetime.date, datetime.date)
+    """
+    months = PARTITION_MONTHS[granularity]
+    start = date(week.year, (week.month - 1) // months * months + 1, 1)
+    month = start.month - 1 + months
+    return start, date(start.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start, granularity):
+    """Name of the weekly partition starting on a date, e.g.
+    weekly_y2022m01 or weekly_y2022q1."""
+    if granularity == "monthly":
+        return f"weekly_y{start:%Y}m{start:%m}"
+    return f"weekly_y{start:%Y}q{(start.month + 2) // 3}"
+
+
+def ensure_partitions(conn, weeks):
+    """Create the weekly partitions missing for some collection weeks.
+    Does nothing when weekly isn't partitioned.
+    Parameters
+    ----------
+    conn : psycopg connection
+    weeks : iterable of datetime.date or pd.Timestamp
+
+    Returns
+    -------
+    list of str
+        Names of the partitions created
+    """
+    granularity = partition_granularity(conn)
+    created = []
+    if granularity is not None:
+        for start, end in sorted({partition_bounds(week, granularity)
+                                  for week in weeks}):
+            name = partition_name(start, granularity)
+            if conn.execute("SELECT to_regclass(%s);",
+                            [name]).fetchone()[0] is not None:
+                continue
+            # Loaders running at the same time create each partition once
+            conn.execute("SELECT pg_advisory_xact_lock("
+                         "hashtext('weekly partitions'));")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} "
+                         f"PARTITION OF weekly "
+                         f"FOR VALUES FROM ('{start}') TO ('{end}');")
+            created.append(name)
+    conn.commit()
+    return created
@@ -0,0 +1,32 @@
+"""Fixtures shared by the tests
+
+Tests using the conn fixture drop every table of the database they run
+on, so they only run against the database named by TEST_DB_NAME, on the
+server of the DB_* settings, e.g.
+
+    TEST_DB_NAME=hospitals_test python -m pytest tests
+"""
+import os
+import sys
+import pytest
+
+# Set up parent directory for module imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+@pytest.fixture
+def conn():
+    """Connection to an empty test database, emptied again afterwards."""
+    if "TEST_DB_NAME" not in os.environ:
+        pytest.skip("set TEST_DB_NAME to a database the tests may wipe")
+    import psycopg
+    import db
+    import migrations
+
+    conn = psycopg.connect(**{**db.settings(),
+                              "dbname": os.environ["TEST_DB_NAME"]})
+    migrations.reset(conn)
+    yield conn
+    migrations.reset(conn)
+    conn.close()
@@ -0,0 +1,75 @@
+"""Cleaning of the HHS dataset, without a database"""
+import pandas as pd
+import hhs
+
+HEADER = ("hospital_pk,collection_week,state,hospital_name,address,zip,"
+          "fips_code,geocoded_hospital_address," + ",".join(hhs.cols))
+
+
+def read(tmp_path, rows):
+    """Raw rows of an HHS file holding the given CSV lines."""
+    path = tmp_path / "hhs.csv"
+    path.write_text("\n".join([HEADER] + rows) + "\n")
+    return hhs.read(path)
+
+
+def row(pk, counts, point="POINT (-79.95 40.44)"):
+    """CSV line of a hospital, with the 8 bed counts of hhs.cols."""
+    return (f"{pk},2022-01-07,PA,Hospital {pk},1 Main St,15213,42003,"
+            f"{point}," + ",".join(str(count) for count in counts))
+
+
+def test_clean_splits_weekly_and_demo(tmp_path):
+    df = read(tmp_path, [row("010001", [10, 5, 2, 1, 4, 2, 3, 1]),
+                         row("01000X", [10, 5, 2, 1, 4, 2, 3, 1]),
+                         row("010001", [20, 5, 2, 1, 4, 2, 3, 1])])
+
+    weekly, demo, rejects = hhs.clean(df)
+
+    assert list(weekly["hospital_id"]) == ["010001"]
+    assert weekly["collection_week"].iloc[0] == pd.Timestamp("2022-01-07")
+    assert weekly["adult_beds"].iloc[0] == 10
+    demo = demo[["id", "name", "fips", "latitude", "longitude"]]
+    assert demo.values.tolist() == [
+        ["010001", "Hospital 010001", "42003", 40.44, -79.95]]
+    assert rejects.empty
+
+
+def test_clean_suppressed_counts_are_missing(tmp_path):
+    df = read(tmp_path, [row("010001", [10, 5, -999999, "", 4, 2, 3, 1])])
+
+    weekly, _, rejects = hhs.clean(df)
+
+    assert weekly["pediatric_beds"].isna().all()
+    assert weekly["pediatric_bed_occupied"].isna().all()
+    # beds_covid is only checked against known occupied counts
+    assert weekly["beds_covid"].iloc[0] == 3
+    assert rejects.empty
+
+
+def test_clean_rejects_rows_breaking_a_check(tmp_path):
+    df = read(tmp_path, [row("010001", [10, 12, 2, 1, 4, 2, 3, 1]),
+                         row("010002", [-5, 1, 2, 1, 4, 2, 3, 1]),
+                         row("010003", [10, 5, 2, 1, 4, 2, 9, 1]),
+                         row("010004", [10, 5, 2, 1, 4, 2, 3, 1])])
+
+    weekly, demo, rejects = hhs.clean(df)
+
+    assert list(weekly["hospital_id"]) == ["010004"]
+    assert len(demo) == 4
+    assert list(rejects["failed_rule"]) == [
+        "weekly_adult_bed_occupied_check", "weekly_adult_beds_check",
+        "weekly_beds_covid_check"]
+
+
+def test_clean_keeps_hospital_with_bad_position(tmp_path):
+    df = read(tmp_path, [row("010001", [10, 5, 2, 1, 4, 2, 3, 1],
+                             "POINT (-79.95 140.44)"),
+                         row("010002", [10, 5, 2, 1, 4, 2, 3, 1], "NA")])
+
+    weekly, demo, rejects = hhs.clean(df)
+
+    assert list(weekly["hospital_id"]) == ["010001", "010002"]
+    assert demo["latitude"].isna().all()
+    assert demo["longitude"].tolist()[0] == -79.95
+    assert rejects.empty
@@ -0,0 +1,34 @@
+"""Loads replayed from the columnar cache of cleaned loader output"""
+from datetime import date
+import loader_cache
+import migrations
+import quality
+
+CSV = """\
+Facility ID,Hospital Type,Hospital Ownership,Emergency Services,\
+Hospital overall rating
+010001,Acute Care Hospitals,Proprietary,Yes,3
+010002,,,,Not Available
+"""
+
+
+def test_write_cached_quality_entry(conn, tmp_path):
+    migrations.migrate(conn)
+    path = tmp_path / "quality-2022-01-01.csv"
+    path.write_text(CSV)
+    raw = quality.read(path)
+    df, df_quality, rejects = quality.clean(raw, "2022-01-01")
+    cache = loader_cache.EntryWriter(tmp_path / "cache", "quality", "c0ffee",
+                                     str(path), date(2022, 1, 1))
+    cache.add(len(raw), {"demo": df, "quality": df_quality,
+                         "rejects": rejects})
+    cache.close()
+
+    (df, df_quality, _), = loader_cache.read_parts(
+        cache.path, ["demo", "quality", "rejects"])
+    assert quality.write(conn, df, df_quality) == (2, 1)
+    assert conn.execute(
+        "SELECT id, type_of_hospital, emergency_service FROM demo "
+        "ORDER BY id;").fetchall() == [
+            ("010001", "Acute Care Hospitals", True),
+            ("010002", None, None)]
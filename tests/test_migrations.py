@@ -0,0 +1,128 @@
+"""Upgrade of databases created at an older schema version"""
+from datetime import date
+import pandas as pd
+import pytest
+import hhs
+import hospital_grid
+import migrations
+import quality
+import schema
+import validate
+
+
+def migrate_to(conn, version):
+    """Apply the migrations up to a version, as an older release did."""
+    migrations.current_version(conn)
+    for number, name, func in migrations.MIGRATIONS:
+        if number > version:
+            break
+        func(conn)
+        conn.execute("INSERT INTO schema_version (version, name) "
+                     "VALUES (%s, %s);", [number, name])
+        conn.commit()
+
+
+def test_migrate_version_3_with_weekly_rows(conn):
+    migrate_to(conn, 3)
+    conn.execute("INSERT INTO demo (id, name, latitude, longitude) "
+                 "VALUES ('h1', 'Hospital', 40.44, -79.95);")
+    conn.execute("INSERT INTO weekly (hospital_id, collection_week, "
+                 "adult_beds) VALUES ('h1', '2022-01-07', 10);")
+    conn.commit()
+
+    applied = migrations.migrate(conn)
+
+    assert [number for number, _ in applied] == [
+        number for number, _, _ in migrations.MIGRATIONS[3:]]
+    assert conn.execute(
+        "SELECT collection_week, hospital_records FROM weekly_rollup;"
+    ).fetchall() == [(date(2022, 1, 7), 1)]
+    assert conn.execute(
+        "SELECT collection_week, row_count FROM week_catalog;"
+    ).fetchall() == [(date(2022, 1, 7), 1)]
+
+
+def test_migrations_fill_tables_like_the_loaders(conn):
+    migrate_to(conn, 3)
+    conn.execute("""
+        INSERT INTO demo (id, state, latitude, longitude, emergency_service)
+        VALUES ('h1', 'PA', 40.44, -79.95, TRUE),
+            ('h2', 'PA', 40.5, -80.0, FALSE),
+            ('h3', 'AK', 61.2, -149.9, NULL),
+            ('h4', NULL, NULL, NULL, TRUE);""")
+    conn.execute("""
+        INSERT INTO weekly (hospital_id, collection_week, adult_beds,
+                            beds_covid)
+        VALUES ('h1', '2022-01-07', 10, 2), ('h2', '2022-01-07', 5, NULL),
+            ('h1', '2022-01-14', 12, 3);""")
+    conn.execute("""
+        INSERT INTO quality (hospital_id, date, quality_score)
+        VALUES ('h1', '2021-07-01', 3), ('h1', '2022-01-01', 4),
+            ('h3', '2022-01-01', 2);""")
+    conn.commit()
+
+    migrations.migrate(conn)
+    # Columns of each table, valid_to being 'infinity' for most ratings
+    tables = {"weekly_rollup": "*",
+              "quality_asof": "hospital_id, quality_score, valid_from, "
+                              "valid_to::text",
+              "hospital_grid": "*"}
+    filled = {table: conn.execute(f"SELECT {columns} FROM {table} "
+                                  f"ORDER BY 1, 2, 3, 4;").fetchall()
+              for table, columns in tables.items()}
+    hhs.refresh_rollup(conn, [date(2022, 1, 7), date(2022, 1, 14)])
+    quality.refresh_asof(conn, ["h1", "h2", "h3"])
+    hospital_grid.refresh(conn)
+
+    for table, columns in tables.items():
+        assert filled[table]
+        refreshed = conn.execute(f"SELECT {columns} FROM {table} "
+                                 f"ORDER BY 1, 2, 3, 4;").fetchall()
+        assert refreshed == filled[table]
+
+
+def test_migrate_version_9_with_duplicate_rejects(conn):
+    migrate_to(conn, 9)
+    for _ in range(2):
+        conn.execute("INSERT INTO load_rejects (dataset, file_name, "
+                     "table_name, failed_rule, row_data) VALUES ('hhs', "
+                     "'a.csv', 'weekly', 'weekly_icu_beds_check', "
+                     "'{\"icu_beds\": -1}');")
+    conn.commit()
+
+    migrations.migrate(conn)
+    rule = ("weekly_icu_beds_check", validate.non_negative("icu_beds"))
+    _, rejects = validate.split(pd.DataFrame({"icu_beds": [-1, -2]}),
+                                "weekly", [rule])
+    validate.record_rejects(conn, "hhs", "/data/a.csv", rejects)
+    validate.record_rejects(conn, "hhs", "/data/a.csv", rejects)
+
+    assert conn.execute(
+        "SELECT row_data FROM load_rejects ORDER BY id;"
+    ).fetchall() == [({"icu_beds": -1},), ({"icu_beds": -2},)]
+
+
+def test_partition_existing_weekly_fails(conn):
+    migrations.migrate(conn)
+
+    with pytest.raises(ValueError, match="isn't partitioned"):
+        migrations.migrate(conn, "monthly")
+
+
+def test_migrate_partitioned_weekly_without_comment(conn):
+    migrate_to(conn, 10)
+    conn.autocommit = True
+    conn.execute("DROP TABLE weekly;")
+    migrations.base_tables(conn, "quarterly")
+    conn.execute("CREATE TABLE weekly_y2022q1 PARTITION OF weekly "
+                 "FOR VALUES FROM ('2022-01-01') TO ('2022-04-01');")
+    conn.execute("COMMENT ON TABLE weekly IS NULL;")
+    conn.autocommit = False
+
+    migrations.migrate(conn)
+
+    assert schema.partition_granularity(conn) == "quarterly"
+    assert schema.ensure_partitions(conn, [date(2022, 5, 6)]) == [
+        "weekly_y2022q2"]
+    with pytest.raises(ValueError, match="already partitioned quarterly"):
+        migrations.migrate(conn, "monthly")
@@ -0,0 +1,68 @@
+"""Vectorized constraint rules, without a database"""
+import json
+import pandas as pd
+import validate
+
+
+def test_split_reports_first_broken_rule():
+    df = pd.DataFrame({"hospital_id": ["010001", None, "010003", "010004"],
+                       "icu_beds": [10.0, -1.0, -2.0, None],
+                       "icu_bed_occupied": [5.0, 1.0, 1.0, 3.0]})
+    rules = [("weekly_hospital_id_not_null", validate.not_null("hospital_id")),
+             ("weekly_icu_beds_check", validate.non_negative("icu_beds")),
+             ("weekly_icu_bed_occupied_check",
+              validate.at_most("icu_bed_occupied",
+                               lambda df: df["icu_beds"]))]
+
+    valid, rejects = validate.split(df, "weekly", rules)
+
+    # Comparisons with a missing value pass, like a CHECK on NULL
+    assert list(valid["hospital_id"]) == ["010001", "010004"]
+    assert list(rejects["failed_rule"]) == ["weekly_hospital_id_not_null",
+                                            "weekly_icu_beds_check"]
+    assert set(rejects["table_name"]) == {"weekly"}
+    assert json.loads(rejects["row_data"].iloc[1]) == {
+        "hospital_id": "010003", "icu_beds": -2.0, "icu_bed_occupied": 1.0}
+
+
+def test_split_without_rejects():
+    df = pd.DataFrame({"id": ["010001"]})
+
+    valid, rejects = validate.split(df, "demo", validate.DEMO_RULES)
+
+    assert len(valid) == 1
+    assert rejects.empty
+    assert list(rejects.columns) == ["table_name", "failed_rule", "row_data"]
+
+
+def test_references_keeps_missing_ids():
+    df = pd.DataFrame({"hospital_id": ["010001", "010002", None]})
+
+    broken = validate.references("hospital_id", pd.Series(["010001"]))(df)
+
+    assert list(broken) == [False, True, False]
+
+
+def test_clear_nulls_bad_values_and_keeps_rows():
+    df = pd.DataFrame({"id": ["010001", "010002", "010003"],
+                       "latitude": [40.44, 123.4, None],
+                       "longitude": [-79.95, -80.0, -1234.5]})
+
+    cleared = validate.clear(df, validate.DEMO_CLEARED)
+
+    assert list(cleared["id"]) == ["010001", "010002", "010003"]
+    assert cleared["latitude"].tolist()[0] == 40.44
+    assert cleared[["latitude", "longitude"]].isna().values.tolist() == [
+        [False, False], [True, False], [True, True]]
+    assert cleared["latitude"].dtype == float
+    assert df["latitude"].notna().sum() == 2
+
+
+def test_clear_emergency_service_tokens():
+    df = pd.DataFrame({"hospital_id": ["010001", "010002", "010003"],
+                       "emergency_service": ["Yes", " no ", "maybe"]},
+                      dtype=object)
+
+    cleared = validate.clear(df, validate.QUALITY_DEMO_CLEARED)
+
+    assert cleared["emergency_service"].tolist() == ["Yes", " no ", None]
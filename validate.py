@@ -0,0 +1,175 @@
+"""Vectorized checks mirroring the table constraints in schema.py
+
+Rows that would make an INSERT fail are split off before writing and
+kept in the load_rejects table together with the name of the rule they
+broke, so one bad row no longer aborts a whole load. Rules are named
+after the Postgres constraint they mirror. Comparisons against missing
+values pass, like a CHECK constraint on NULL. Bad values of nullable
+demo columns are set to NULL instead, keeping the hospital's row for the
+weekly and quality rows that reference it.
+"""
+import json
+import os
+import pandas as pd
+
+
+# Spellings Postgres accepts for a boolean
+BOOLEAN_TOKENS = {"t", "true", "y", "yes", "on", "1",
+                  "f", "false", "n", "no", "off", "0"}
+
+
+def not_null(column):
+    """Rule for a NOT NULL column."""
+    return lambda df: df[column].isna()
+
+
+def non_negative(column):
+    """Rule for CHECK (column >= 0)."""
+    return lambda df: df[column] < 0
+
+
+def at_most(column, limit):
+    """Rule for CHECK (column >= 0 AND column <= limit)."""
+    return lambda df: (df[column] < 0) | (df[column] > limit(df))
+
+
+def fits_decimal(column, digits):
+    """Rule for a DECIMAL column with this many digits before the point."""
+    return lambda df: df[column].astype(float).round(6).abs() >= 10 ** digits
+
+
+def is_boolean(column):
+    """Rule for a BOOLEAN column filled from text."""
+    return lambda df: df[column].notna() & ~df[column].astype(
+        "string").str.strip().str.lower().isin(BOOLEAN_TOKENS)
+
+
+def references(column, ids):
+    """Rule for a foreign key, given the ids that will exist."""
+    return lambda df: df[column].notna() & ~df[column].isin(ids)
+
+
+DEMO_RULES = [
+    ("demo_id_not_null", not_null("id")),
+]
+
+QUALITY_DEMO_RULES = [
+    ("demo_id_not_null", not_null("hospital_id")),
+]
+
+# Nullable demo columns and the rules their values are cleared on
+DEMO_CLEARED = [
+    ("latitude", fits_decimal("latitude", 2)),
+    ("longitude", fits_decimal("longitude", 3)),
+]
+
+QUALITY_DEMO_CLEARED = [
+    ("emergency_service", is_boolean("emergency_service")),
+]
+
+WEEKLY_RULES = [
+    ("weekly_hospital_id_not_null", not_null("hospital_id")),
+    ("weekly_collection_week_not_null", not_null("collection_week")),
+    ("weekly_adult_beds_check", non_negative("adult_beds")),
+    ("weekly_adult_bed_occupied_check",
+     at_most("adult_bed_occupied", lambda df: df["adult_beds"])),
+    ("weekly_pediatric_beds_check", non_negative("pediatric_beds")),
+    ("weekly_pediatric_bed_occupied_check",
+     at_most("pediatric_bed_occupied", lambda df: df["pediatric_beds"])),
+    ("weekly_icu_beds_check", non_negative("icu_beds")),
+    ("weekly_icu_bed_occupied_check",
+     at_most("icu_bed_occupied", lambda df: df["icu_beds"])),
+    ("weekly_beds_covid_check",
+     at_most("beds_covid", lambda df: df["adult_bed_occupied"]
+             + df["pediatric_bed_occupied"])),
+    ("weekly_icu_covid_check",
+     at_most("icu_covid", lambda df: df["icu_bed_occupied"])),
+]
+
+QUALITY_RULES = [
+    ("quality_hospital_id_not_null", not_null("hospital_id")),
+    ("quality_date_not_null", not_null("date")),
+    ("quality_quality_score_not_null", not_null("quality_score")),
+]
+
+
+def split(df, table, rules):
+    """Split rows into those passing every rule and rejects.
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Rows for the table, with the table's column names
+    table : str
+        Name of the table
+    rules : list of (str, callable)
+        Rule names and functions returning True for rows breaking them
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame)
+        Valid rows, and rejects with the columns table_name, failed_rule
+        and row_data, the rejected row as JSON. A row breaking several
+        rules is reported under the first one.
+    """
+    failed = pd.Series(None, index=df.index, dtype=object)
+    for name, broken in rules:
+        broken = broken(df).fillna(False).astype(bool)
+        failed = failed.mask(failed.isna() & broken, name)
+    bad = failed.notna()
+    rejects = pd.DataFrame({
+        "table_name": table,
+        "failed_rule": failed[bad],
+        "row_data": [json.dumps(row, default=str) for row in
+                     df[bad].astype(object).where(df[bad].notna(), None)
+                     .to_dict("records")]},
+        columns=["table_name", "failed_rule", "row_data"])
+    return df[~bad], rejects
+
+
+def clear(df, rules):
+    """Set the values of nullable columns breaking a rule to NULL.
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Rows for the table, with the table's column names
+    rules : list of (str, callable)
+        Column names and functions returning True for rows whose value
+        of the column breaks its constraint
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows, every one of them kept
+    """
+    df = df.copy()
+    for column, broken in rules:
+        broken = broken(df).fillna(False).astype(bool)
+        df.loc[broken, column] = None
+    return df
+
+
+def record_rejects(conn, dataset, file_path, rejects):
+    """Store rejected rows in the load_rejects table, skipping those
+    already recorded for the file, e.g. by a rerun with --force.
+    Parameters
+    ----------
+    conn : psycopg connection
+    dataset : str
+        "hhs" or "quality"
+    file_path : str
+        File the rows came from
+    rejects : pd.DataFrame
+        Rejects returned by split
+    """
+    if rejects.empty:
+        return
+    file_name = os.path.basename(file_path)
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO load_rejects (dataset, file_name, table_name, "
+        "failed_rule, row_data) VALUES (%s, %s, %s, %s, %s) "
+        "ON CONFLICT (dataset, file_name, table_name, failed_rule, "
+        "md5(row_data::text)) DO NOTHING;",
+        [(dataset, file_name, row.table_name, row.failed_rule, row.row_data)
+         for row in rejects.itertuples(index=False)])
+    conn.commit()
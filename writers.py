@@ -0,0 +1,114 @@
+"""Row writers and table refreshes shared by the loaders"""
+
+
+def insert_rows(cur, table, columns, rows, conflict):
+    """Insert rows one statement per row with executemany.
+    Parameters
+    ----------
+    cur : psycopg cursor
+    table : str
+        Target table
+    columns : list of str
+        Target columns, in the order of the values in each row
+    rows : list of tuple
+        Rows to insert
+    conflict : str
+        ON CONFLICT clause applied to every row
+
+    Returns
+    -------
+    int
+        Number of rows inserted or updated
+    """
+    placeholders = ", ".join(["%s"] * len(columns))
+    cur.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({placeholders}) {conflict};",
+        rows
+    )
+    return cur.rowcount
+
+
+def stage_rows(cur, staging, columns, rows):
+    """Stream rows into a staging table with COPY.
+    Parameters
+    ----------
+    cur : psycopg cursor
+    staging : str
+        Staging table, already created
+    columns : list of str
+        Staging columns, in the order of the values in each row
+    rows : iterable of tuple
+        Rows to copy
+    """
+    with cur.copy(f"COPY {staging} ({', '.join(columns)}) FROM STDIN") \
+            as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+def copy_rows(cur, table, columns, rows, conflict):
+    """Bulk insert rows with COPY into a temporary staging table followed
+    by a single set-based INSERT ... SELECT.
+    Parameters
+    ----------
+    cur : psycopg cursor
+    table : str
+        Target table
+    columns : list of str
+        Target columns, in the order of the values in each row
+    rows : list of tuple
+        Rows to insert
+    conflict : str
+        ON CONFLICT clause applied to the INSERT ... SELECT
+
+    Returns
+    -------
+    int
+        Number of rows inserted or updated
+    """
+    column_list = ", ".join(columns)
+    staging = f"{table}_staging"
+    # Staging table with the target column types but no constraints,
+    # dropped automatically when the transaction commits
+    cur.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                f"SELECT {column_list} FROM {table} WITH NO DATA;")
+    stage_rows(cur, staging, columns, rows)
+    cur.execute(f"INSERT INTO {table} ({column_list}) "
+                f"SELECT {column_list} FROM {staging} {conflict};")
+    return cur.rowcount
+
+
+def refresh_rows(conn, table, refresh, params, column=None, keys=None,
+                 finish=None):
+    """Recompute rows of a table derived from others, in one transaction:
+    lock the table, delete the rows to recompute, insert them again and
+    commit.
+    Parameters
+    ----------
+    conn : psycopg connection
+    table : str
+        Derived table
+    refresh : str
+        INSERT ... SELECT recomputing the deleted rows
+    params : list
+        Parameters of refresh
+    column : str, optional
+        Column of the rows to recompute, every row when None
+    keys : list, optional
+        Values of column of the rows to recompute
+    finish : callable, optional
+        Called with conn before the commit, to refresh other tables in
+        the same transaction
+    """
+    # One refresh at a time, so concurrent loads can't insert a row twice
+    conn.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE;")
+    if column is None:
+        conn.execute(f"DELETE FROM {table};")
+    else:
+        conn.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s);",
+                     [keys])
+    conn.execute(refresh, params)
+    if finish is not None:
+        finish(conn)
+    conn.commit()